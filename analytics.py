@@ -0,0 +1,239 @@
+import math
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimate in O(1) memory and time per sample
+    (the P-squared algorithm of Jain & Chlamtac).
+    """
+
+    def __init__(self, q):
+        self.q = q
+        self.heights = []
+        self.pos = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self.step = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def add(self, x):
+        h = self.heights
+        if len(h) < 5:
+            h.append(x)
+            h.sort()
+            return
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if h[i] <= x < h[i + 1])
+        for i in range(k + 1, 5):
+            self.pos[i] += 1
+        for i in range(5):
+            self.desired[i] += self.step[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - self.pos[i]
+            if (d >= 1 and self.pos[i + 1] - self.pos[i] > 1) or \
+               (d <= -1 and self.pos[i - 1] - self.pos[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = self._parabolic(i, d)
+                if not h[i - 1] < candidate < h[i + 1]:
+                    candidate = h[i] + d * (h[i + d] - h[i]) / (self.pos[i + d] - self.pos[i])
+                h[i] = candidate
+                self.pos[i] += d
+
+    def _parabolic(self, i, d):
+        h, n = self.heights, self.pos
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self):
+        h = self.heights
+        if not h:
+            return None
+        if len(h) < 5:
+            return h[min(len(h) - 1, int(round(self.q * (len(h) - 1))))]
+        return h[2]
+
+
+class CycleStats:
+    """
+    Running cycle-time statistics: count, mean/stdev (Welford), min/max,
+    median and p90 (P-squared), EWMA and least-squares trend in seconds per
+    cycle. Every update is O(1).
+    """
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = self.max = None
+        self.ewma = None
+        self.p50 = P2Quantile(0.5)
+        self.p90 = P2Quantile(0.9)
+        # sums for the regression of cycle time on cycle index
+        self._sx = self._sy = self._sxx = self._sxy = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        delta = seconds - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (seconds - self.mean)
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        self.ewma = seconds if self.ewma is None else self.ewma + self.alpha * (seconds - self.ewma)
+        self.p50.add(seconds)
+        self.p90.add(seconds)
+        x = float(self.count)
+        self._sx += x
+        self._sy += seconds
+        self._sxx += x * x
+        self._sxy += x * seconds
+
+    def trend(self):
+        n = self.count
+        denom = n * self._sxx - self._sx * self._sx
+        if n < 2 or denom == 0:
+            return None
+        return (n * self._sxy - self._sx * self._sy) / denom
+
+    def to_dict(self):
+        return {
+            "cycles": self.count,
+            "avg":    self.mean if self.count else None,
+            "stdev":  math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else None,
+            "min":    self.min,
+            "max":    self.max,
+            "p50":    self.p50.value(),
+            "p90":    self.p90.value(),
+            "ewma":   self.ewma,
+            "trend":  self.trend()
+        }
+
+
+class Bucket:
+    """
+    Aggregates for one shift or one program.
+    """
+
+    def __init__(self, key, started):
+        self.key = key
+        self.started = started
+        self.updated = started
+        self.power_on = 0.0
+        self.motion = 0.0
+        self.parts = 0
+        self.cycles = CycleStats()
+
+    def to_dict(self):
+        hours = self.power_on / 3600
+        return {
+            "key":            self.key,
+            "started":        self.started.isoformat(),
+            "updated":        self.updated.isoformat(),
+            "power_on_s":     self.power_on,
+            "motion_s":       self.motion,
+            "utilization":    100.0 * self.motion / self.power_on if self.power_on else None,
+            "parts":          self.parts,
+            "parts_per_hour": self.parts / hours if hours else None,
+            "cycle_time":     self.cycles.to_dict()
+        }
+
+
+class MachineAnalytics:
+    """
+    Incremental utilization / cycle-time / parts analytics for one machine,
+    fed with the parsed fields of every reading.
+
+    Utilization is motion time over power-on time (Q301/Q300 deltas); a part
+    is counted when the M30 counter (Q402) goes up, and the latest last-cycle
+    time (Q303) is taken as that part's cycle time. Results are kept per
+    shift and per running program (from Q500), keeping the most recent
+    `keep_shifts` shifts and `keep_programs` programs.
+    """
+
+    def __init__(self, shift_starts=(6, 14, 22), keep_shifts=21, keep_programs=200):
+        self.shift_starts = sorted(shift_starts)
+        self.keep_shifts = keep_shifts
+        self.keep_programs = keep_programs
+        self.shifts = OrderedDict()
+        self.programs = OrderedDict()
+        self.program = None
+        self._last = {}
+        self._last_cycle_time = None
+        self._lock = threading.Lock()
+
+    def shift_key(self, ts):
+        """
+        "<date> #<n>" of the shift containing `ts`; a night shift that
+        crosses midnight belongs to the day it started.
+        """
+        starts = self.shift_starts
+        hour = ts.hour + ts.minute / 60
+        if hour < starts[0]:
+            return f"{(ts - timedelta(days=1)).date().isoformat()} #{len(starts)}"
+        n = max(i for i, s in enumerate(starts) if hour >= s) + 1
+        return f"{ts.date().isoformat()} #{n}"
+
+    def _bucket(self, table, key, ts, keep):
+        bucket = table.get(key)
+        if bucket is None:
+            bucket = table[key] = Bucket(key, ts)
+            while len(table) > keep:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(key)
+        bucket.updated = ts
+        return bucket
+
+    def _delta(self, name, value):
+        last = self._last.get(name)
+        self._last[name] = value
+        if last is None or value < last:
+            # first sample, or the counter was reset
+            return 0
+        return value - last
+
+    def update(self, fields, ts):
+        if not fields:
+            return
+        with self._lock:
+            if fields.get("program"):
+                self.program = fields["program"]
+            targets = [self._bucket(self.shifts, self.shift_key(ts), ts, self.keep_shifts)]
+            if self.program:
+                targets.append(self._bucket(self.programs, self.program, ts, self.keep_programs))
+
+            if "power_on_time" in fields:
+                d = self._delta("power_on_time", fields["power_on_time"])
+                for b in targets:
+                    b.power_on += d
+            if "motion_time" in fields:
+                d = self._delta("motion_time", fields["motion_time"])
+                for b in targets:
+                    b.motion += d
+            if "last_cycle_time" in fields:
+                self._last_cycle_time = fields["last_cycle_time"]
+            if "m30_counter_1" in fields:
+                d = self._delta("m30_counter_1", fields["m30_counter_1"])
+                if d:
+                    for b in targets:
+                        b.parts += d
+                        if self._last_cycle_time:
+                            b.cycles.add(self._last_cycle_time)
+
+    def summary(self):
+        with self._lock:
+            current = next(reversed(self.shifts.values()), None)
+            return {
+                "program":       self.program,
+                "current_shift": current.to_dict() if current else None,
+                "shifts":        [b.to_dict() for b in reversed(self.shifts.values())],
+                "programs":      [b.to_dict() for b in reversed(self.programs.values())]
+            }
@@ -1,39 +1,34 @@
-import sys
-import subprocess
-
-def _ensure_installed(pkg_name, import_name=None):
-    """
-    Try to import `import_name` (or pkg_name if None); if missing, pip-install pkg_name.
-    """
-    try:
-        __import__(import_name or pkg_name)
-    except ImportError:
-        print(f"Installing {pkg_name}…")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", pkg_name])
-
-_ensure_installed("SQLAlchemy", "sqlalchemy")
-_ensure_installed("pyodbc")
-_ensure_installed("gspread")
-_ensure_installed("oauth2client")
-
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session
 import os
 import re
+import subprocess
 import json
 import time
+import urllib.request
 import serial
 import serial.tools.list_ports
-from serial_sender import send_file
+from serial_sender import SendJob
+from q_transport import QTransport
+from poll_scheduler import PollGroup, PollScheduler
+from change_filter import ChangeFilter
+from batch_writer import BatchWriter
+from spool import Spool, Forwarder
+from machines import Machine, load_registry, save_registry
+from monitor_log import BufferedLog
+from metrics import REGISTRY
+from config_store import STORE as CONFIG
+from q_parsers import parse_response, numeric_value
+from rules import compile_rules
+from sheets_writer import get_row_writer, get_sheets_client
+from gateway_service import (LeaderLock, LocalGateway, ServiceClient, ServiceError,
+                             ServiceServer)
 from datetime import datetime, timedelta
 import threading
-from sqlalchemy import create_engine, Table, Column, Integer, String, DateTime, MetaData
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from werkzeug.utils import secure_filename
 
 
 
-UPLOAD_FOLDER = "uploads/haas1"
+MACHINES_FILE = "machines.json"
 CONFIG_FILE = "serial_config.json"
 MACHINE_INFO_FILE = "machine_info.json"
 LOG_FILE = "transfer_log.txt"
@@ -41,6 +36,41 @@ MONITOR_LOG_FILE = "cnc_monitor_log.txt"
 CONFIG_PATH = "q600_config.json"
 LOG_CONFIG = "log_config.json"
 NETWORK_CONFIG = "network_config.json"
+SPOOL_FILE = "spool.db"
+# the process holding LEADER_LOCK owns the serial ports and serves the web
+# workers on SERVICE_SOCKET (see service.py)
+LEADER_LOCK = "gateway.lock"
+SERVICE_SOCKET = "gateway.sock"
+
+# Buffered, rotating writers for the two text logs; no thread or file
+# handle exists until the first line is written
+transfer_log = BufferedLog(LOG_FILE, echo=False, flush_interval=1.0)
+monitor_log = BufferedLog(MONITOR_LOG_FILE)
+
+# Prometheus metrics served at /metrics (serial, sender and spool ones are
+# defined next to the code they measure)
+POLL_SECONDS = REGISTRY.histogram(
+    "cnc_poll_group_seconds", "Time to poll every command of a group", ("machine", "group"))
+POLL_LAG = REGISTRY.gauge(
+    "cnc_poll_lag_seconds", "How late the last poll of a group started", ("machine", "group"))
+POLL_MISSED = REGISTRY.counter(
+    "cnc_poll_missed_deadlines_total", "Poll slots skipped because a group ran late", ("machine", "group"))
+POLL_FAILURES = REGISTRY.counter(
+    "cnc_poll_failures_total", "Poll passes aborted by an error", ("machine",))
+TAG_TIMEOUTS = REGISTRY.counter(
+    "cnc_tag_timeouts_total", "Replies that didn't complete in time", ("machine", "tag"))
+TAG_EMPTY = REGISTRY.counter(
+    "cnc_tag_empty_responses_total", "Empty replies", ("machine", "tag"))
+SEND_RATE = REGISTRY.gauge(
+    "cnc_send_bytes_per_second", "Throughput of running drip-feeds", ("machine",))
+SPOOL_PENDING = REGISTRY.gauge(
+    "cnc_spool_pending_rows", "Readings waiting in the spool for the back-end")
+WRITER_QUEUED = REGISTRY.gauge(
+    "cnc_spool_writer_queued_rows", "Readings queued for the spool")
+WRITER_DROPPED = REGISTRY.gauge(
+    "cnc_spool_writer_dropped_rows", "Readings dropped because the spool queue was full")
+ALERTS_RAISED = REGISTRY.counter(
+    "cnc_alerts_raised_total", "Alert rules that went active", ("machine", "severity"))
 
 
 last_static_run = None
@@ -64,6 +94,20 @@ dynamic_commands = {
     "?Q500": "Program/Status/Parts",
 
 }
+
+# dynamic commands that change fast enough to deserve their own short period
+fast_commands = ["?Q104", "?Q500"]
+
+# seconds between polls per tier; None = once at startup,
+# "polling_rate" = follow the machine-info polling rate.
+# machine_info.json may override any of these under "poll_periods".
+DEFAULT_POLL_PERIODS = {
+    "static":  None,
+    "fast":    1,
+    "dynamic": "polling_rate",
+    "q600":    "polling_rate",
+    "tables":  300
+}
 q600_variables = {
     # General machine status
     "Feed Timer": (3022, "Total feed time used on current part"),
@@ -129,122 +173,157 @@ q600_variables = {
     "Tool Load Monitor Limit": (list(range(5901, 6001)), "Configured load limit per tool")
 }
 
+# tags polled for each Q600 range, as named in build_poll_groups()
+q600_ranges = {
+    label: [f"{label} [{c}]" for c in codes]
+    for label, (codes, _) in q600_variables.items() if isinstance(codes, list)
+}
+
+# alert rules for a machine without a rules.json. Each compares a tag with
+# a constant "value" or with "factor" x an "other" tag; "rate" compares its
+# change per "per" seconds instead. "range"/"other_range" expand to one rule
+# per tool. "for"/"clear_for" (seconds) debounce raising and clearing.
+DEFAULT_RULES = [
+    {"id": "atm-next-tool-life", "tag": "ATM % Tool Life (Next Tool)", "op": "<=", "value": 10,
+     "severity": "warning", "message": "Next tool is nearly worn out", "for": 0, "clear_for": 30},
+    {"id": "atm-load", "tag": "ATM Load Monitor Max", "op": ">=", "other": "ATM Load Limit",
+     "factor": 0.9, "severity": "critical", "message": "Spindle load near the tool's limit"},
+    {"id": "tool-life", "range": "Tool Life Counters", "other_range": "Tool Life Limits",
+     "op": ">=", "factor": 0.9, "severity": "warning", "message": "Tool life at 90% of its limit"},
+    {"id": "tool-load", "range": "Tool Load Monitor Max", "other_range": "Tool Load Monitor Limit",
+     "op": ">=", "factor": 0.9, "severity": "critical", "message": "Tool load at 90% of its limit"},
+]
+
+# what /api/query accepts: a Q-command, optionally with a macro variable
+QUERY_RE = re.compile(r'^Q\d{3}( \d{1,5})?$')
+# seconds /api/query waits for the port (e.g. behind a send) before giving
+# up; well inside the web workers' service call timeout
+QUERY_WAIT = 10
+
+PROGRAM_RE = re.compile(r'^\s*O(\d+)\s*(.*)', re.IGNORECASE)
+
 def get_program_name(filepath):
-    prog_re = re.compile(r'^\s*O(\d+)\s*(.*)', re.IGNORECASE)
     with open(filepath, 'r', errors='ignore') as f:
         for line in f:
-            m = prog_re.match(line)
+            m = PROGRAM_RE.match(line)
             if m:
                 num, name = m.group(1), m.group(2).strip()
                 return f"{num} {name}" if name else num
     return os.path.splitext(os.path.basename(filepath))[0]
 
 
-serial_lock = threading.Lock()
-
-def load_serial_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    return {
+def load_serial_config(path=CONFIG_FILE):
+    return CONFIG.load(path, {
         "port": "/dev/ttyUSB0",
         "baudrate": 115200,
         "bytesize": 8,
         "parity": "None",
         "stopbits": 1
-    }
+    })
 
-def save_serial_config(config):
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=4)
+def save_serial_config(config, path=CONFIG_FILE):
+    CONFIG.save(path, config)
 
-def load_machine_info():
-    if os.path.exists(MACHINE_INFO_FILE):
-        with open(MACHINE_INFO_FILE, "r") as f:
-            return json.load(f)
-    return {
+def load_machine_info(path=MACHINE_INFO_FILE):
+    return CONFIG.load(path, {
         "name": "Haas VF2",
         "manufacturer": "Haas",
         "polling_rate": 5
-    }
+    })
 
-def save_machine_info(info):
-    with open(MACHINE_INFO_FILE, "w") as f:
-        json.dump(info, f, indent=4)
+def save_machine_info(info, path=MACHINE_INFO_FILE):
+    CONFIG.save(path, info)
 
-def load_q600_config():
-    if os.path.exists(CONFIG_PATH):
-        return json.load(open(CONFIG_PATH))
+def load_q600_config(path=CONFIG_PATH):
     # default: no selections
-    return {"q600_selected": []}
+    return CONFIG.load(path, {"q600_selected": []})
 
-def save_q600_config(selected_labels):
-    data = {"q600_selected": selected_labels}
-    with open(CONFIG_PATH, "w") as f:
-        json.dump(data, f, indent=4)
+def save_q600_config(selected_labels, path=CONFIG_PATH):
+    CONFIG.save(path, {"q600_selected": selected_labels})
 
 def load_log_config():
-    if os.path.exists(LOG_CONFIG):
-        return json.load(open(LOG_CONFIG))
-    return {
+    return CONFIG.load(LOG_CONFIG, {
       "backend": "sheet",
       "sheet_id": "<YOUR_DEFAULT_SHEET_ID>",
       "sql_conn": "",
-      "service_account_info": {}
-    }
+      "service_account_info": {},
+      "echo_monitor_log": True,
+      "heartbeat": 900,
+      "default_deadband": 0.0,
+      "deadbands": {}
+    })
 
 def save_log_config(cfg):
-    with open(LOG_CONFIG, "w") as f:
-        json.dump(cfg, f, indent=4)
+    CONFIG.save(LOG_CONFIG, cfg)
+
+def load_rules(path):
+    return CONFIG.load(path, {"rules": DEFAULT_RULES})
+
+def save_rules(rules, path):
+    CONFIG.save(path, {"rules": rules})
 
 def append_log(message):
-    with open(LOG_FILE, "a") as log:
-        log.write(message + "\n")
+    transfer_log.write(message)
 
 def read_log():
-    if not os.path.exists(LOG_FILE):
-        return []
-    with open(LOG_FILE, "r") as log:
-        return log.readlines()[-20:]
+    return transfer_log.tail(20)
+
+_transports = {}
+
+def get_transport(port):
+    """
+    One QTransport per serial port, so the latency estimate survives reopening.
+    """
+    if port not in _transports:
+        _transports[port] = QTransport()
+    return _transports[port]
 
 def send_q_command(ser, command):
-    if not command.endswith('\r'):
-        command += '\r'
-    ser.write(command.encode('ascii'))
-    time.sleep(0.3)
-    return ser.read_all().decode('ascii', errors='ignore').strip()
+    return get_transport(ser.port).query(ser, command)
+
+def post_alerts(alerts, urls, timeout=5):
+    """
+    POST a batch of alerts as JSON to each webhook URL (a local relay,
+    chat hook or MES endpoint); a failing URL doesn't stop the others.
+    """
+    body = json.dumps({"alerts": alerts}).encode()
+    for url in urls:
+        req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                resp.read()
+        except Exception as e:
+            print(f"[ALERTS] Webhook {url} failed: {e}")
 
-def log_entry(tag, command, response, program_name=None):
+def log_entry(tag, command, response, program_name=None, machine=None):
     """
-    Write one line to the CNC monitor log, including the current program name if provided.
+    Write one line to the CNC monitor log, including the machine and the
+    current program name if provided.
     """
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     line = f"{timestamp} | {tag} | {command} -> {response}"
+    if machine:
+        line = f"{timestamp} | {machine} | {tag} | {command} -> {response}"
     if program_name:
         line += f" | Program: {program_name}"
-    print(line)
-    with open(MONITOR_LOG_FILE, 'a') as f:
-        f.write(line + '\n')
+    monitor_log.write(line)
 
 def load_network_config():
     """
     Read network_config.json if it exists, otherwise return defaults
     for both wired (eth0) and wireless (wlan0).
     """
-    if os.path.exists(NETWORK_CONFIG):
-        return json.load(open(NETWORK_CONFIG))
-    return {
+    return CONFIG.load(NETWORK_CONFIG, {
         "wired":   {"use_dhcp": True, "address": "", "netmask": "", "gateway": "", "dns": ""},
         "wireless":{"use_dhcp": True, "address": "", "netmask": "", "gateway": "", "dns": ""}
-    }
+    })
 
 def save_network_config(cfg):
     """
     Write out the given dict (with `wired` and `wireless` keys)
     to network_config.json.
     """
-    with open(NETWORK_CONFIG, "w") as f:
-        json.dump(cfg, f, indent=2)
+    CONFIG.save(NETWORK_CONFIG, cfg)
 
 def apply_interface(iface, settings):
     """
@@ -275,7 +354,7 @@ def apply_network(cfg):
     apply_interface("wlan0",  cfg["wireless"])
 
 
-def update_machine_info_from_q_commands(serial_config):
+def update_machine_info_from_q_commands(machine):
     def clean_response(response):
         lines = response.splitlines()
         for line in lines:
@@ -285,151 +364,273 @@ def update_machine_info_from_q_commands(serial_config):
         return response.strip()
 
     try:
-        with serial.Serial(
-            port=serial_config["port"],
-            baudrate=serial_config["baudrate"],
-            bytesize=serial_config["bytesize"],
-            parity=serial_config["parity"],
-            stopbits=serial_config["stopbits"],
-            timeout=1,
-            xonxoff=True
-        ) as ser:
-            def query(cmd):
-                ser.write((cmd + "\r").encode("ascii"))
-                time.sleep(0.3)
-                return ser.read_all().decode("ascii", errors="ignore").strip()
-
-            serial_number = clean_response(query("Q100"))
-            software_version = clean_response(query("Q101"))
-            model_number = clean_response(query("Q102"))
-
-            machine_info = load_machine_info()
-            machine_info.update({
+        with machine.serial_conn.session(owner="info") as ser:
+            serial_number = clean_response(send_q_command(ser, "Q100"))
+            software_version = clean_response(send_q_command(ser, "Q101"))
+            model_number = clean_response(send_q_command(ser, "Q102"))
+
+            machine.info.update({
                 "serial_number": serial_number,
                 "software_version": software_version,
                 "model_number": model_number
             })
 
-            save_machine_info(machine_info)
+            save_machine_info(machine.info, machine.info_path)
 
     except Exception as e:
-        print(f"[WARN] Could not auto-update machine info: {e}")
+        print(f"[WARN] Could not auto-update machine info for {machine.id}: {e}")
 
-def monitor_machine(machine_info, serial_config,
-                    latest_readings,
-                    log_cfg, sql_engine, sql_table, sheet_client):
+def build_poll_groups(machine_info, selected_labels):
     """
-    Polls static & dynamic commands, plus user-selected Q600 variables,
-    updates latest_readings, and persists to SQL or Google Sheets.
+    Split the polled commands into PollGroups by tier: static Q1xx once,
+    fast dynamic tags, the remaining dynamic tags, scalar Q600 variables,
+    and one group per Q600 table range.
     """
-    update_machine_info_from_q_commands(serial_config)
-
-    # Map config string to pySerial constants
-    parity_map = {
-        "N": serial.PARITY_NONE,
-        "E": serial.PARITY_EVEN,
-        "O": serial.PARITY_ODD,
-        "None": serial.PARITY_NONE,
-        None: serial.PARITY_NONE
-    }
-
-    # Load the user’s Q600 variable selections
-    cfg = load_q600_config()
-    selected_labels = cfg.get("q600_selected", [])
-
-    # Build Q600 command list: for each label, each code → "?{code}"
-    q600_cmds = []
+    periods = dict(DEFAULT_POLL_PERIODS)
+    periods.update(machine_info.get("poll_periods", {}))
+
+    def period(tier):
+        p = periods.get(tier)
+        if p == "polling_rate":
+            return lambda: machine_info.get("polling_rate", 5)
+        return p
+
+    groups = [PollGroup("static", static_commands.items(), period("static"))]
+    for cmd in fast_commands:
+        groups.append(PollGroup(cmd, [(cmd, dynamic_commands[cmd])], period("fast")))
+    groups.append(PollGroup(
+        "dynamic",
+        [(c, t) for c, t in dynamic_commands.items() if c not in fast_commands],
+        period("dynamic")
+    ))
+
+    # Q600: scalars share one group, each range (tool table) is its own
+    scalars = []
     for label in selected_labels:
         codes = q600_variables[label][0]
         if isinstance(codes, list):
-            for c in codes:
-                q600_cmds.append((f"?{c}", f"{label} [{c}]"))
+            groups.append(PollGroup(
+                label,
+                [(f"?{c}", f"{label} [{c}]") for c in codes],
+                period("tables"),
+                bulk=True
+            ))
         else:
-            q600_cmds.append((f"?{codes}", label))
+            scalars.append((f"?{codes}", label))
+    if scalars:
+        groups.append(PollGroup("q600", scalars, period("q600")))
+    return groups
 
-    # Combine all commands
-    all_cmds = list(static_commands.items()) \
-               + list(dynamic_commands.items()) \
-               + q600_cmds
+def refresh_poll_plan(machine, selected_labels=None):
+    """
+    Rebuild the machine's poll plan from its machine info and Q600
+    selection; the running poller switches over at its next scheduling point.
+    """
+    if selected_labels is None:
+        selected_labels = load_q600_config(machine.q600_path).get("q600_selected", [])
+    machine.poll_plan.replace(build_poll_groups(machine.info, selected_labels))
+
+def monitor_machine(machine, log_cfg, spool_writer, alert_writer=None):
+    """
+    Polls one machine's static & dynamic commands, plus its user-selected
+    Q600 variables, on a thread of its own. Updates the machine's latest
+    readings, in-memory history and live feed, checks its alert rules, and
+    spools changed readings for the Forwarder to persist to SQL or Google
+    Sheets.
+    """
+    machine_info = machine.info
+    serial_conn = machine.serial_conn
+    latest_readings = machine.latest_readings
+    plan = machine.poll_plan
+
+    # saving either file (from the UI or by hand) swaps in a new poll plan
+    def info_changed(path, info):
+        if info != machine_info:
+            machine_info.clear()
+            machine_info.update(info)
+        refresh_poll_plan(machine)
+    CONFIG.subscribe(machine.info_path, info_changed)
+    CONFIG.subscribe(machine.q600_path, lambda path, cfg:
+                     refresh_poll_plan(machine, cfg.get("q600_selected", [])))
+    refresh_poll_plan(machine)
+
+    # alert rules are recompiled whenever rules.json is saved or edited
+    def rules_changed(path, cfg):
+        try:
+            machine.rules.load(cfg.get("rules", []), q600_ranges)
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"[RULES] {machine.id}: keeping the old rules, {path} is invalid: {e!r}")
+    CONFIG.subscribe(machine.rules_path, rules_changed)
+    rules_changed(machine.rules_path, load_rules(machine.rules_path))
+
+    # alerts go to the monitor log, /api/alerts and the webhook queue
+    def on_alert(alert):
+        alert = dict(alert, machine=machine.id)
+        if alert["state"] == "raised":
+            ALERTS_RAISED.inc(machine=machine.id, severity=alert["severity"])
+        monitor_log.write(
+            f"{datetime.fromtimestamp(alert['time']).strftime('%Y-%m-%d %H:%M:%S')} | {machine.id} | "
+            f"ALERT {alert['state'].upper()} | {alert['severity']} | {alert['rule']} | "
+            f"{alert['message']} ({alert['value']:g} {alert['op']} {alert['limit']:g})")
+        if alert_writer is not None and log_cfg.get("alert_webhooks"):
+            alert_writer.put(alert)
+    machine.rules.on_alert = [on_alert]
+
+    # Only changed values (or heartbeats) go to the back-ends
+    change_filter = ChangeFilter(
+        deadbands=log_cfg.get("deadbands"),
+        default_deadband=log_cfg.get("default_deadband", 0.0),
+        heartbeat=log_cfg.get("heartbeat", 900)
+    )
+
+    # Each tier/group is polled on its own period from a deadline queue
+    scheduler = PollScheduler()
 
     def monitor_loop():
+        # refresh serial/model/version here rather than in create_app(), so
+        # startup never waits on the serial line
+        update_machine_info_from_q_commands(machine)
+        applied = None
         while True:
-            batch_rows = []
+            # pick up a new poll plan between polls; tag state is kept
+            if plan.version != applied:
+                applied, groups = plan.snapshot()
+                added, changed, removed = scheduler.apply(groups)
+                if applied > 1 and (added or changed or removed):
+                    print(f"[MONITOR] {machine.id} poll plan v{applied}: "
+                          f"added {added}, changed {changed}, removed {removed}")
+            wait = scheduler.next_due()
+            if plan.wait(machine_info.get("polling_rate", 5) if wait is None else wait):
+                continue
+            due = scheduler.pop_due()
             try:
-                with serial_lock:
-                    # normalize parity
-                    raw_par = serial_config.get("parity", "N")
-                    par = parity_map.get(raw_par, serial.PARITY_NONE)
-
-                    with serial.Serial(
-                        port=serial_config["port"],
-                        baudrate=serial_config["baudrate"],
-                        bytesize=serial_config["bytesize"],
-                        parity=par,
-                        stopbits=serial_config["stopbits"],
-                        timeout=1,
-                        xonxoff=True
-                    ) as ser:
-
-                        for cmd, tag in all_cmds:
-                            result    = send_q_command(ser, cmd)
+                with serial_conn.session(owner="monitor") as ser:
+                    while due:
+                        group = due[0]
+                        started = time.monotonic()
+                        POLL_LAG.set(max(0.0, started - group.deadline),
+                                     machine=machine.id, group=group.name)
+                        transport = get_transport(ser.port)
+                        # tool-table ranges go out pipelined in one batch
+                        results = None
+                        if group.bulk:
+                            results = transport.query_many(
+                                ser, [cmd for cmd, _ in group.commands], preempt=serial_conn)
+                        for i, (cmd, tag) in enumerate(group.commands):
+                            # a send or operator query waiting gets the port
+                            # between our commands, not after the whole pass
+                            if not results:
+                                ser = serial_conn.checkpoint(ser)
+                            timeouts = transport.timeouts
+                            result    = results[i] if results else send_q_command(ser, cmd)
+                            if not results and transport.timeouts != timeouts:
+                                TAG_TIMEOUTS.inc(machine=machine.id, tag=tag)
+                            if not result:
+                                TAG_EMPTY.inc(machine=machine.id, tag=tag)
                             timestamp = datetime.now()
+                            fields    = parse_response(cmd, result)
                             # log with optional current program name if you have it
-                            log_entry(tag, cmd, result)
+                            log_entry(tag, cmd, result, machine=machine.id)
 
                             # update UI store
                             latest_readings[tag] = {
                                 "value":     result,
-                                "timestamp": timestamp.isoformat()
+                                "timestamp": timestamp.isoformat(),
+                                "fields":    fields
                             }
-
-                            # persist to SQL
-                            if log_cfg.get("backend") == "sql" and sql_engine and sql_table:
-                                ins = sql_table.insert().values(
-                                    tag=tag,
-                                    value=result,
-                                    polled_at=timestamp
-                                )
-                                sql_engine.execute(ins)
-
-                            # or queue for Sheets
-                            elif log_cfg.get("backend") == "sheet" and sheet_client:
-                                batch_rows.append([
-                                    timestamp.isoformat(), tag, result
-                                ])
+                            number = numeric_value(fields)
+                            machine.history.record(tag, timestamp.timestamp(),
+                                                   result if number is None else number,
+                                                   group.current_period())
+                            machine.live_feed.publish(tag, result, timestamp.isoformat())
+                            machine.analytics.update(fields, timestamp)
+                            if number is not None:
+                                machine.rules.feed(tag, number, timestamp.timestamp())
+
+                            if not change_filter.should_store(tag, result):
+                                continue
+
+                            # spool for whichever back-end is configured
+                            if backend_configured(log_cfg):
+                                spool_writer.put((tag, result, timestamp.isoformat(),
+                                                  machine.id, json.dumps(fields)))
+                        POLL_SECONDS.observe(time.monotonic() - started,
+                                             machine=machine.id, group=group.name)
+                        missed = scheduler.done(group, started)
+                        if missed:
+                            POLL_MISSED.inc(missed, machine=machine.id, group=group.name)
+                        due.pop(0)
 
             except Exception as e:
-                print(f"[MONITOR] Failed: {e}")
-
-            # batch‐write to Google Sheets
-            if log_cfg.get("backend") == "sheet" and sheet_client and batch_rows:
-                sheet_client.values_append(
-                    "Sheet1!A:C",
-                    params={"valueInputOption": "RAW"},
-                    body={"values": batch_rows}
-                )
+                POLL_FAILURES.inc(machine=machine.id)
+                print(f"[MONITOR] {machine.id} failed: {e}")
+                # requeue whatever didn't finish; after a cable glitch come
+                # back as soon as the port may reconnect, not a whole interval
+                if serial_conn.healthy():
+                    delay = machine_info.get("polling_rate", 5)
+                else:
+                    delay = min(serial_conn.retry_in(), machine_info.get("polling_rate", 5))
+                for group in due:
+                    scheduler.retry(group, delay)
 
-            time.sleep(machine_info.get("polling_rate", 5))
-
-    threading.Thread(target=monitor_loop, daemon=True).start()
+    threading.Thread(target=monitor_loop, name=f"monitor-{machine.id}", daemon=True).start()
 
 
 
 
 
 def init_sql_engine(conn_str):
-    engine = create_engine(f"mssql+pyodbc:///?odbc_connect={conn_str}")
+    # SQLAlchemy/pyodbc are only needed (and installed) for the SQL back-end
+    from sqlalchemy import create_engine, inspect, text, Table, Column, Integer, Float, String, DateTime, MetaData
+    import sql_history
+
+    engine = create_engine(
+        f"mssql+pyodbc:///?odbc_connect={conn_str}",
+        fast_executemany=True
+    )
     meta = MetaData()
     poll_table = Table('machine_poll', meta,
         Column('id', Integer, primary_key=True),
         Column('tag', String(128)),
         Column('value', String(256)),
         Column('polled_at', DateTime),
+        Column('machine', String(128)),
+    )
+    # typed fields parsed from each reply, one row per field
+    field_table = Table('machine_poll_fields', meta,
+        Column('id', Integer, primary_key=True),
+        Column('machine', String(128)),
+        Column('tag', String(128)),
+        Column('field', String(64)),
+        Column('num_value', Float),
+        Column('text_value', String(128)),
+        Column('polled_at', DateTime),
     )
+    rollup_table, poll_index = sql_history.define_tables(meta, poll_table)
     meta.create_all(engine)
-    return engine, poll_table
+    # tables created before multi-machine support lack the machine column
+    columns = [c["name"] for c in inspect(engine).get_columns('machine_poll')]
+    if 'machine' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE machine_poll ADD machine NVARCHAR(128) NULL"))
+    sql_history.create_indexes(engine, poll_index)
+    return engine, poll_table, field_table, rollup_table
+
+_sql_engines = {}
+
+def get_sql_engine(conn_str):
+    """
+    init_sql_engine() once per connection string, shared by the forwarder
+    and the history API.
+    """
+    if conn_str not in _sql_engines:
+        _sql_engines[conn_str] = init_sql_engine(conn_str)
+    return _sql_engines[conn_str]
 
 def init_sheet_client(sheet_id, service_account_info):
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
     scope = [
       "https://spreadsheets.google.com/feeds",
       "https://www.googleapis.com/auth/drive"
@@ -443,7 +644,11 @@ def init_sheet_client(sheet_id, service_account_info):
 def init_sheet_client_from_dict(service_account_info):
     """
     Build a gspread client from a dict (no file upload needed).
+    gspread/oauth2client are only needed for the Sheets back-end.
     """
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
     scope = [
         'https://spreadsheets.google.com/feeds',
         'https://www.googleapis.com/auth/drive'
@@ -451,37 +656,381 @@ def init_sheet_client_from_dict(service_account_info):
     creds = ServiceAccountCredentials.from_json_keyfile_dict(service_account_info, scope)
     return gspread.authorize(creds)
 
+def sheets_client(log_cfg):
+    """
+    The cached SheetsClient for the configured spreadsheet.
+    """
+    return get_sheets_client(init_sheet_client_from_dict,
+                             log_cfg["service_account_info"], log_cfg["sheet_id"])
+
+def sheet_header():
+    """
+    Header row of a new machine worksheet: one column per polled tag. The
+    per-tool tags of Q600 ranges ("Tool Flutes [1601]") only get a column
+    once they are polled, so a tab isn't thousands of columns wide.
+    """
+    all_tags = list(static_commands.values()) + list(dynamic_commands.values())
+    all_q600 = [label for label in q600_variables if label not in q600_ranges]
+    return ["Timestamp"] + all_tags + all_q600
+
+def backend_configured(log_cfg):
+    """
+    True if log_cfg names a back-end and has what it needs to connect.
+    """
+    if log_cfg.get("backend") == "sql":
+        return bool(log_cfg.get("sql_conn"))
+    if log_cfg.get("backend") == "sheet":
+        return bool(log_cfg.get("sheet_id") and log_cfg.get("service_account_info"))
+    return False
+
+def connect_backend(log_cfg, tab_for=lambda machine: machine):
+    """
+    Connect to the configured back-end and return a function that writes a
+    list of spooled (tag, value, polled_at_iso, machine, fields_json) rows to
+    it, or None if unconfigured. SQL also gets one typed row per parsed field;
+    Sheets gets wide rows in the worksheet named by `tab_for(machine_id)`.
+    """
+    if not backend_configured(log_cfg):
+        return None
+
+    if log_cfg["backend"] == "sql":
+        import sql_history
+        engine, table, field_table, rollup_table = get_sql_engine(log_cfg["sql_conn"])
+
+        def write_sql(rows):
+            raw_rows, field_rows, numbers = [], [], []
+            for tag, value, ts, machine, fields in rows:
+                polled_at = datetime.fromisoformat(ts)
+                raw_rows.append({"tag": tag, "value": value, "polled_at": polled_at,
+                                 "machine": machine})
+                parsed = json.loads(fields or "{}")
+                number = numeric_value(parsed)
+                if number is not None:
+                    numbers.append((machine, tag, polled_at.timestamp(), float(number)))
+                for name, v in parsed.items():
+                    number = v if isinstance(v, (int, float)) else None
+                    field_rows.append({
+                        "machine":    machine,
+                        "tag":        tag,
+                        "field":      name,
+                        "num_value":  number,
+                        "text_value": None if number is not None else str(v),
+                        "polled_at":  polled_at
+                    })
+            with engine.begin() as conn:
+                conn.execute(table.insert(), raw_rows)
+                if field_rows:
+                    conn.execute(field_table.insert(), field_rows)
+                sql_history.apply_rollups(conn, rollup_table, sql_history.aggregate(numbers))
+        return write_sql
+
+    return get_row_writer(sheets_client(log_cfg), tab_for, sheet_header())
+
+
+
+
+
+def load_machine(entry, hardware=True):
+    config_dir = entry.get("config_dir", os.path.join("machines", entry["id"]))
+    return Machine(
+        entry,
+        load_serial_config(os.path.join(config_dir, "serial_config.json")),
+        load_machine_info(os.path.join(config_dir, "machine_info.json")),
+        hardware
+    )
+
+def start_gateway(log_cfg):
+    """
+    The half of the app that owns the hardware: spool and forwarder, alert
+    webhooks, and one Machine with its monitor thread per registry entry
+    (entries added to machines.json later start as they appear). Only the
+    holder of the leader lock may run it. Returns {machine id: Machine}.
+    """
+    machines = {}
+
+    # Readings are spooled to disk first, then forwarded in batches; spool
+    # writes happen on their own thread, never under a serial port
+    spool = Spool(SPOOL_FILE)
+    def machine_tab(machine_id):
+        m = machines.get(machine_id)
+        return m.name if m else machine_id
+
+    forwarder = Forwarder(spool, lambda: connect_backend(log_cfg, machine_tab),
+                          backend=lambda: log_cfg.get("backend", "none"))
+    spool_writer = BatchWriter(spool.append_many, name="SPOOL", flush_interval=1.0)
+    # alerts are POSTed to log_config "alert_webhooks" off the poll thread
+    alert_writer = BatchWriter(lambda alerts: post_alerts(alerts, log_cfg.get("alert_webhooks", [])),
+                               name="WEBHOOK", batch_size=50, flush_interval=1.0, max_queue=1000)
+
+    # the settings form and hand edits both land here; reconnect the
+    # forwarder with the new back-end settings
+    def log_config_changed(path, cfg):
+        if cfg != log_cfg:
+            log_cfg.clear()
+            log_cfg.update(cfg)
+        monitor_log.echo = log_cfg.get("echo_monitor_log", True)
+        forwarder.reset()
+    CONFIG.subscribe(LOG_CONFIG, log_config_changed)
+
+    def collect_metrics():
+        SPOOL_PENDING.set(spool.count())
+        stats = spool_writer.stats()
+        WRITER_QUEUED.set(stats["queued"])
+        WRITER_DROPPED.set(stats["dropped"])
+        for m in list(machines.values()):
+            running = [j.to_dict() for j in list(m.send_jobs.values()) if j.status == "running"]
+            SEND_RATE.set(sum(j["bytes_per_sec"] for j in running), machine=m.id)
+    REGISTRY.add_collector(collect_metrics)
+
+    # monitors skip persistence until back-ends are configured
+    def registry_changed(path, registry):
+        for entry in registry["machines"]:
+            if entry["id"] not in machines:
+                machine = load_machine(entry)
+                machines[machine.id] = machine
+                monitor_machine(machine, log_cfg, spool_writer, alert_writer)
+    CONFIG.subscribe(MACHINES_FILE, registry_changed)
+    registry_changed(MACHINES_FILE, load_registry(MACHINES_FILE))
+    return machines
+
+def follow_registry():
+    """
+    Config-only Machines for a web worker, kept in step with machines.json
+    and with the machine info and serial settings the service writes.
+    """
+    machines = {}
+
+    def update(target):
+        def changed(path, data):
+            if data != target:
+                target.clear()
+                target.update(data)
+        return changed
+
+    def registry_changed(path, registry):
+        for entry in registry["machines"]:
+            if entry["id"] not in machines:
+                machine = load_machine(entry, hardware=False)
+                CONFIG.subscribe(machine.info_path, update(machine.info))
+                CONFIG.subscribe(machine.serial_config_path, update(machine.serial_config))
+                machines[machine.id] = machine
+    CONFIG.subscribe(MACHINES_FILE, registry_changed)
+    registry_changed(MACHINES_FILE, load_registry(MACHINES_FILE))
+    return machines
+
+def gateway_handlers(machines):
+    """
+    What the web side needs from whoever owns the hardware, as named
+    operations taking a machine id and returning plain JSON data. Served on
+    SERVICE_SOCKET, or called in-process when the app owns the hardware.
+    """
+    def get(machine):
+        if machine not in machines:
+            raise ServiceError(f"unknown machine {machine!r}")
+        return machines[machine]
+
+    def readings(machine):
+        return dict(get(machine).latest_readings)
+
+    def live_snapshot(machine):
+        return get(machine).live_feed.snapshot()
+
+    def live_since(machine, seq, epoch=None, wait=15):
+        return get(machine).live_feed.since(seq, timeout=wait, epoch=epoch)
+
+    def history(machine, tag, start, end, points=None):
+        history = get(machine).history
+        if points:
+            return [{"t": t, "min": lo, "max": hi, "avg": avg, "last": last}
+                    for t, lo, hi, avg, last in history.downsample(tag, start, end, points)]
+        return [{"t": t, "v": v} for t, v in history.range(tag, start, end)]
+
+    def analytics(machine):
+        return get(machine).analytics.summary()
+
+    def alerts(machine):
+        return get(machine).rules.summary()
+
+    def serial_stats(machine):
+        return get(machine).serial_conn.stats()
+
+    def query(machine, command):
+        # interactive priority: waits for at most one poll command, but
+        # gives up rather than queue behind a whole send
+        m = get(machine)
+        asked = time.monotonic()
+        with m.serial_conn.session(owner="query", timeout=QUERY_WAIT) as ser:
+            waited = time.monotonic() - asked
+            result = send_q_command(ser, "?" + command)
+        return {"command": command, "response": result,
+                "fields": parse_response("?" + command, result), "waited": waited}
+
+    def jobs(machine):
+        jobs = get(machine).send_jobs
+        return [jobs[i].to_dict() for i in sorted(jobs, reverse=True)]
+
+    def send(machine, filename, program=None):
+        m = get(machine)
+        filepath = os.path.join(m.upload_folder, filename)
+        program = program or m.program_index.get(filename)["program"]
+
+        # once the transfer ends: update machine info & log
+        def finished(job):
+            if job.status == "done":
+                update_machine_info_from_q_commands(m)
+                append_log(f"Sent: {filename} ({program}) to {m.id} - {job.lines} lines "
+                           f"in {job.to_dict()['elapsed']:.1f}s")
+            elif job.status == "cancelled":
+                append_log(f"Cancelled: {filename} after {job.lines} lines")
+            else:
+                append_log(f"Failed: {filename} - {job.error}")
+
+        job = SendJob(m.serial_conn, filepath, on_done=finished).start()
+        jobs = m.send_jobs
+        jobs[job.id] = job
+        # keep only the most recent transfers around
+        for old in sorted(jobs)[:-20]:
+            if jobs[old].finished:
+                del jobs[old]
+        return {"id": job.id, "program": program}
+
+    def cancel(machine, job_id):
+        job = get(machine).send_jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancel()
+        return job.filename
+
+    def metrics():
+        return REGISTRY.render()
 
+    return {
+        "readings":      readings,
+        "live_snapshot": live_snapshot,
+        "live_since":    live_since,
+        "history":       history,
+        "analytics":     analytics,
+        "alerts":        alerts,
+        "serial":        serial_stats,
+        "query":         query,
+        "jobs":          jobs,
+        "send":          send,
+        "cancel":        cancel,
+        "metrics":       metrics,
+    }
 
 
+def create_app(mode=None):
+    """
+    Build the Flask app. `mode` defaults to $CNC_GATEWAY_MODE, else "auto":
 
-def create_app():
+    auto  the first process to take the leader lock owns the serial ports
+          and serves the others on SERVICE_SOCKET; any later one (the
+          reloader's child, further gunicorn workers) runs as "web"
+    web   never touches the hardware; live data, sends and queries go to
+          the process holding the lock, normally service.py
+    """
+    mode = mode or os.environ.get("CNC_GATEWAY_MODE", "auto")
+    if mode not in ("auto", "web"):
+        raise ValueError(f"Unknown gateway mode {mode!r}; use auto or web")
     app = Flask(__name__)
     app.secret_key = "cnc-secret-key"
 
-    # Core configuration
-    app.config["UPLOAD_FOLDER"]   = UPLOAD_FOLDER
-    app.config["SERIAL_CONFIG"]   = load_serial_config()
-    app.config["MACHINE_INFO"]    = load_machine_info()
-    app.config["LATEST_READINGS"] = {}
-
-    # Load (or default) logging settings; do NOT init back-ends yet
+    # Load (or default) logging settings; the forwarder connects to the
+    # back-end itself once it is configured and reachable
     log_cfg = load_log_config()
     app.config["LOG_CONFIG"] = log_cfg
+    monitor_log.echo = log_cfg.get("echo_monitor_log", True)
+
+    def log_config_changed(path, cfg):
+        if cfg != log_cfg:
+            log_cfg.clear()
+            log_cfg.update(cfg)
+    CONFIG.subscribe(LOG_CONFIG, log_config_changed)
+
+    lock = LeaderLock(LEADER_LOCK)
+    if mode == "auto" and lock.acquire():
+        # One Machine (config, port, library, live data, monitor thread)
+        # per registry entry, shared with other workers over the socket
+        machines = start_gateway(log_cfg)
+        handlers = gateway_handlers(machines)
+        ServiceServer(SERVICE_SOCKET, handlers).start()
+        app.config["LEADER_LOCK"] = lock
+        app.config["GATEWAY"] = LocalGateway(handlers)
+    else:
+        machines = follow_registry()
+        app.config["GATEWAY"] = ServiceClient(SERVICE_SOCKET)
+    app.config["MACHINES"] = machines
+    gateway = app.config["GATEWAY"]
+
+    @app.errorhandler(ServiceError)
+    def service_error(e):
+        return jsonify({"error": str(e)}), 503
+
+    def current_machine():
+        """
+        The machine this request is about: ?machine=<id>, else the one picked
+        in this browser session, else the first registered.
+        """
+        machines = app.config["MACHINES"]
+        machine_id = request.values.get("machine") or session.get("machine")
+        if machine_id not in machines:
+            machine_id = next(iter(machines))
+        return machines[machine_id]
+
+    @app.context_processor
+    def inject_machines():
+        return {"machines": app.config["MACHINES"]}
+
+    @app.route("/machine/<machine_id>")
+    def select_machine(machine_id):
+        if machine_id in app.config["MACHINES"]:
+            session["machine"] = machine_id
+        else:
+            flash(f"Unknown machine: {machine_id}", "danger")
+        return redirect(request.referrer or url_for("index"))
+
+    @app.route("/machines", methods=["POST"])
+    def register_machine():
+        """
+        Add a machine to the registry and start polling it right away.
+        """
+        machine_id = secure_filename(request.form.get("machine_id", "").strip())
+        port = request.form.get("port", "").strip()
+        if not machine_id or not port:
+            flash("Machine ID and serial port are required.", "warning")
+            return redirect(url_for("index"))
+        if machine_id in app.config["MACHINES"]:
+            flash(f"Machine {machine_id} already exists.", "danger")
+            return redirect(url_for("index"))
+        if any(m.serial_config["port"] == port for m in app.config["MACHINES"].values()):
+            flash(f"{port} is already used by another machine.", "danger")
+            return redirect(url_for("index"))
 
-    # Start the monitor thread; it will skip persistence until back-ends are configured
-    monitor_machine(
-        app.config["MACHINE_INFO"],
-        app.config["SERIAL_CONFIG"],
-        app.config["LATEST_READINGS"],
-        log_cfg,
-        None,  # sql_engine
-        None,  # sql_table
-        None   # sheet_client
-    )
+        entry = {
+            "id": machine_id,
+            "config_dir": os.path.join("machines", machine_id),
+            "upload_folder": os.path.join("uploads", machine_id)
+        }
+        os.makedirs(entry["config_dir"], exist_ok=True)
+        serial_cfg = load_serial_config(os.path.join(entry["config_dir"], "serial_config.json"))
+        serial_cfg["port"] = port
+        save_serial_config(serial_cfg, os.path.join(entry["config_dir"], "serial_config.json"))
+        info = load_machine_info(os.path.join(entry["config_dir"], "machine_info.json"))
+        info["name"] = request.form.get("machine_name", "").strip() or machine_id
+        save_machine_info(info, os.path.join(entry["config_dir"], "machine_info.json"))
+
+        # the registry subscription starts its monitor (in the service)
+        registry = load_registry(MACHINES_FILE)
+        registry["machines"].append(entry)
+        save_registry(MACHINES_FILE, registry)
+        session["machine"] = machine_id
+        flash(f"Registered machine {machine_id} on {port}", "success")
+        return redirect(url_for("index"))
 
     @app.route("/", methods=["GET", "POST"])
     def index():
+        m = current_machine()
         log_cfg = app.config["LOG_CONFIG"]
         net_cfg = load_network_config()
         has_tab = False
@@ -492,7 +1041,7 @@ def create_app():
                 f = request.files["file"]
                 if f and f.filename.lower().endswith((".nc", ".txt", ".gcode")):
                     orig_name = secure_filename(f.filename)
-                    temp_path = os.path.join(app.config["UPLOAD_FOLDER"], orig_name)
+                    temp_path = os.path.join(m.upload_folder, orig_name)
                     f.save(temp_path)
 
                     # extract O-code and full program name
@@ -500,33 +1049,43 @@ def create_app():
                     prog_num = prog_full.split(" ", 1)[0]  # "12345"
                     ext = os.path.splitext(orig_name)[1]
                     new_name = f"O{prog_num}{ext}"
-                    new_path = os.path.join(app.config["UPLOAD_FOLDER"], new_name)
+                    new_path = os.path.join(m.upload_folder, new_name)
 
                     os.replace(temp_path, new_path)
+                    if orig_name != new_name:
+                        m.program_index.remove(orig_name)
+                    m.program_index.update(new_name)
 
                     flash(f"Uploaded → {new_name}  (Program: {prog_full})", "success")
-                    append_log(f"Uploaded {new_name} (Program: {prog_full})")
+                    append_log(f"Uploaded {new_name} to {m.id} (Program: {prog_full})")
 
             # ----- SERIAL SETTINGS -----
             if "baudrate" in request.form:
-                cfg = app.config["SERIAL_CONFIG"]
+                cfg = dict(m.serial_config)
                 cfg.update({
+                    "port": request.form.get("port", cfg["port"]).strip() or cfg["port"],
                     "baudrate": int(request.form["baudrate"]),
                     "bytesize": int(request.form["bytesize"]),
                     "parity": request.form["parity"],
                     "stopbits": int(request.form["stopbits"])
                 })
-                save_serial_config(cfg)
-                flash("Serial settings updated", "info")
+                if any(o.serial_config["port"] == cfg["port"]
+                       for o in app.config["MACHINES"].values() if o is not m):
+                    flash(f"{cfg['port']} is already used by another machine.", "danger")
+                else:
+                    # the connection picks the change up from the config store
+                    m.serial_config.update(cfg)
+                    save_serial_config(m.serial_config, m.serial_config_path)
+                    flash("Serial settings updated", "info")
 
             # ----- MACHINE INFO -----
             if "machine_name" in request.form:
-                mi = app.config["MACHINE_INFO"]
+                mi = m.info
                 mi["name"] = request.form["machine_name"]
                 mi["manufacturer"] = request.form["manufacturer"]
                 if "polling_rate" in request.form:
                     mi["polling_rate"] = int(request.form["polling_rate"])
-                save_machine_info(mi)
+                save_machine_info(mi, m.info_path)
                 flash("Machine info updated", "info")
 
             # ----- LOGGING SETTINGS -----
@@ -542,7 +1101,6 @@ def create_app():
                         flash("Invalid Service Account JSON", "danger")
                 save_log_config(log_cfg)
                 flash("Logging settings updated", "info")
-                # you can re-init your SQL or Sheet client here if you want immediate effect
 
             # ----- NETWORK SETTINGS -----
             if "network_submit" in request.form:
@@ -557,12 +1115,11 @@ def create_app():
                 flash("Network settings saved; applying in background…", "info")
 
         # ----- BUILD FILES LIST -----
-        raw_files = os.listdir(app.config["UPLOAD_FOLDER"])
-        files = []
-        for fn in raw_files:
-            path = os.path.join(app.config["UPLOAD_FOLDER"], fn)
-            prog = get_program_name(path)
-            files.append({"filename": fn, "program": prog})
+        search = request.args.get("q", "").strip()
+        page = request.args.get("page", 1, type=int)
+        per_page = 50
+        files, total_files = m.program_index.query(search, page, per_page)
+        pages = max(1, (total_files + per_page - 1) // per_page)
 
         # ----- LOG & SHEET TAB CHECK -----
         log_entries = read_log()
@@ -570,21 +1127,21 @@ def create_app():
                 and log_cfg.get("service_account_info")
                 and log_cfg.get("sheet_id")):
             try:
-                client = init_sheet_client_from_dict(
-                    log_cfg["service_account_info"],
-                    log_cfg["sheet_id"]
-                )
-                sheet = client.open_by_key(log_cfg["sheet_id"])
-                titles = [ws.title for ws in sheet.worksheets()]
-                has_tab = app.config["MACHINE_INFO"]["name"] in titles
+                has_tab = m.name in sheets_client(log_cfg).titles()
             except Exception:
                 has_tab = False
 
         return render_template(
             "index.html",
             files=files,
-            config=app.config["SERIAL_CONFIG"],
-            machine=app.config["MACHINE_INFO"],
+            search=search,
+            page=page,
+            pages=pages,
+            total_files=total_files,
+            config=m.serial_config,
+            machine=m.info,
+            machine_id=m.id,
+            ports=[p.device for p in serial.tools.list_ports.comports()],
             log=log_entries,
             log_config=log_cfg,
             net_cfg=net_cfg,
@@ -593,35 +1150,70 @@ def create_app():
 
     @app.route("/send/<filename>")
     def send(filename):
-        filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-
-        # 1) extract program name
-        prog_name = get_program_name(filepath)
-        flash(f"Sending program: {prog_name}", "info")
+        m = current_machine()
 
+        # look up program name, then stream the file in the background
+        prog_name = m.program_index.get(filename)["program"]
         try:
-            # 2) stream the file
-            with serial_lock:
-                send_file(filepath, **app.config["SERIAL_CONFIG"])
-
-            # 3) update machine info & log
-            update_machine_info_from_q_commands(app.config["SERIAL_CONFIG"])
-            flash(f"Sent {filename} successfully.", "success")
-            append_log(f"Sent: {filename} ({prog_name})")
+            job = gateway.call("send", retry=False, machine=m.id, filename=filename,
+                               program=prog_name)
         except Exception as e:
             flash(f"Failed to send {filename}: {e}", "danger")
             append_log(f"Failed: {filename} - {e}")
+            return redirect(url_for("index"))
 
+        flash(f"Sending program: {prog_name} (transfer #{job['id']})", "info")
+        return redirect(url_for("index"))
+
+    @app.route("/api/jobs")
+    def api_jobs():
+        """
+        Progress of the machine's recent file transfers, newest first.
+        """
+        return jsonify(gateway.call("jobs", machine=current_machine().id))
+
+    @app.route("/api/serial")
+    def api_serial():
+        """
+        Who holds the machine's port and how many sessions of each priority
+        (send, interactive, poll) are waiting for it.
+        """
+        return jsonify(gateway.call("serial", machine=current_machine().id))
+
+    @app.route("/api/query")
+    def api_query():
+        """
+        Run one Q-command now (?cmd=Q500, ?cmd=Q600 5701). It outranks
+        polling, so it waits for at most one poll command, but never
+        interrupts a running send: it answers 503 if the port stays busy
+        for QUERY_WAIT seconds.
+        """
+        cmd = request.args.get("cmd", "").strip().upper()
+        if not QUERY_RE.match(cmd):
+            return jsonify({"error": "expected a Q-command like Q500 or Q600 5701"}), 400
+        try:
+            return jsonify(gateway.call("query", machine=current_machine().id, command=cmd))
+        except Exception as e:
+            return jsonify({"error": str(e)}), 503
+
+    @app.route("/jobs/<int:job_id>/cancel", methods=["POST"])
+    def cancel_job(job_id):
+        filename = gateway.call("cancel", machine=current_machine().id, job_id=job_id)
+        if filename is None:
+            flash(f"No transfer #{job_id}", "danger")
+        else:
+            flash(f"Cancelling transfer #{job_id} ({filename})", "warning")
         return redirect(url_for("index"))
 
     @app.route("/delete/<filename>", methods=["POST"])
     def delete_file(filename):
         # secure against path traversal
-        uploads = app.config["UPLOAD_FOLDER"]
-        filepath = os.path.join(uploads, filename)
+        m = current_machine()
+        filepath = os.path.join(m.upload_folder, filename)
         try:
             if os.path.exists(filepath):
                 os.remove(filepath)
+                m.program_index.remove(filename)
                 flash(f"Deleted {filename}", "warning")
                 append_log(f"Deleted: {filename}")
             else:
@@ -632,29 +1224,178 @@ def create_app():
 
     @app.route("/variables", methods=["GET", "POST"])
     def variable_config():
-        cfg = load_q600_config()
+        m = current_machine()
+        cfg = load_q600_config(m.q600_path)
         selected = cfg.get("q600_selected", [])
         if request.method == "POST":
             selected = request.form.getlist("q600_selected")
-            save_q600_config(selected)
+            save_q600_config(selected, m.q600_path)
             flash("Q600 monitoring variables updated", "info")
             return redirect(url_for("variable_config"))
         return render_template(
             "variables.html",
             q600_variables=q600_variables,
-            selected_q600=selected
+            selected_q600=selected,
+            machine=m.info,
+            machine_id=m.id
         )
 
     @app.route("/livepolling")
     def livepolling():
+        m = current_machine()
         return render_template(
             "livepolling.html",
-            machine=app.config["MACHINE_INFO"],
+            feed_seq="{epoch}:{seq}".format(**gateway.call("live_snapshot", machine=m.id)),
+            machine=m.info,
+            machine_id=m.id,
             static_commands=static_commands,
             dynamic_commands=dynamic_commands,
-            latest_readings=app.config["LATEST_READINGS"]
+            latest_readings=gateway.call("readings", machine=m.id)
         )
 
+    @app.route("/api/live")
+    def api_live():
+        """
+        Latest value of every tag plus the feed's current sequence number.
+        """
+        return jsonify(gateway.call("live_snapshot", machine=current_machine().id))
+
+    @app.route("/api/live/stream")
+    def api_live_stream():
+        """
+        Server-Sent Events stream of changed tags. Resumes after the
+        Last-Event-ID header (or ?since=); without either it starts with a
+        snapshot event.
+        """
+        machine_id = current_machine().id
+        # event ids are "<feed epoch>:<seq>"; a bare number is taken as-is
+        epoch, _, last = request.headers.get("Last-Event-ID",
+                                             request.args.get("since", "")).rpartition(":")
+        try:
+            last = int(last)
+        except ValueError:
+            last = -1
+
+        def stream():
+            current, seq = epoch or None, last
+            if seq < 0:
+                snap = gateway.call("live_snapshot", machine=machine_id)
+                current, seq = snap["epoch"], snap["seq"]
+                yield f"event: snapshot\nid: {current}:{seq}\ndata: {json.dumps(snap)}\n\n"
+            while True:
+                kind, payload = gateway.call("live_since", machine=machine_id, seq=seq,
+                                             epoch=current, wait=15)
+                if kind == "snapshot":
+                    current, seq = payload["epoch"], payload["seq"]
+                    yield f"event: snapshot\nid: {current}:{seq}\ndata: {json.dumps(payload)}\n\n"
+                elif payload:
+                    seq = payload[-1]["seq"]
+                    yield f"id: {current}:{seq}\ndata: {json.dumps(payload)}\n\n"
+                else:
+                    yield ": keepalive\n\n"
+                # coalesce bursts of changes into fewer messages per viewer
+                time.sleep(0.25)
+
+        return Response(stream(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache"})
+
+    @app.route("/metrics")
+    def metrics():
+        """
+        Poller, serial, sender and back-end metrics in Prometheus text format.
+        """
+        return Response(gateway.call("metrics"), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/api/history")
+    def api_history_sql():
+        """
+        Stored history of one tag from the SQL back-end.
+        Query args: tag, from / to (epoch seconds or ISO time, default the
+        last 24 hours) and bucket (e.g. 5m, 1h, 1d) for min/max/avg/last
+        buckets served from the rollup tables; without it, raw readings.
+        """
+        log_cfg = app.config["LOG_CONFIG"]
+        if log_cfg.get("backend") != "sql" or not log_cfg.get("sql_conn"):
+            return jsonify({"error": "History needs the SQL back-end"}), 404
+        tag = request.args.get("tag")
+        if not tag:
+            return jsonify({"error": "tag is required"}), 400
+
+        def when(name, default):
+            raw = request.args.get(name)
+            if not raw:
+                return default
+            try:
+                return float(raw)
+            except ValueError:
+                return datetime.fromisoformat(raw).timestamp()
+
+        import sql_history
+        try:
+            end = when("to", time.time())
+            start = when("from", end - 86400)
+            bucket = request.args.get("bucket")
+            bucket = sql_history.parse_bucket(bucket) if bucket else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        m = current_machine()
+        engine, table, _, rollup_table = get_sql_engine(log_cfg["sql_conn"])
+        data = sql_history.query_history(engine, table, rollup_table, m.id, tag,
+                                         start, end, bucket)
+        return jsonify({"tag": tag, "machine": m.id, "from": start, "to": end,
+                        "bucket": bucket, "data": data})
+
+    @app.route("/api/history/<path:tag>")
+    def api_history(tag):
+        """
+        Recent samples for one tag from the in-memory ring buffer.
+        Query args: from / to (epoch seconds, default last hour) and
+        points (downsample into that many min/max/avg/last buckets).
+        """
+        now = time.time()
+        end = request.args.get("to", now, type=float)
+        start = request.args.get("from", end - 3600, type=float)
+        points = request.args.get("points", type=int)
+
+        data = gateway.call("history", machine=current_machine().id, tag=tag,
+                            start=start, end=end, points=points)
+        return jsonify({"tag": tag, "from": start, "to": end, "data": data})
+
+    @app.route("/api/analytics")
+    def api_analytics():
+        """
+        Utilization, parts and cycle-time statistics for the current shift,
+        recent shifts and each program run since startup.
+        """
+        return jsonify(gateway.call("analytics", machine=current_machine().id))
+
+    @app.route("/api/alerts")
+    def api_alerts():
+        """
+        Active alerts and recent transitions of the current machine.
+        """
+        return jsonify(gateway.call("alerts", machine=current_machine().id))
+
+    @app.route("/api/rules", methods=["GET", "POST"])
+    def api_rules():
+        """
+        GET the current machine's rule specs; POST {"rules": [...]} to
+        replace them (they are compiled first, so bad specs are rejected).
+        """
+        m = current_machine()
+        if request.method == "GET":
+            return jsonify(load_rules(m.rules_path))
+        rules = (request.get_json(silent=True) or {}).get("rules")
+        if not isinstance(rules, list):
+            return jsonify({"error": "expected {\"rules\": [...]}"}), 400
+        try:
+            compile_rules(rules, q600_ranges)
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"error": f"invalid rule: {e!r}"}), 400
+        save_rules(rules, m.rules_path)
+        return jsonify({"rules": rules})
+
     @app.route("/add_machine", methods=["POST"])
     def add_machine():
         log_cfg = app.config["LOG_CONFIG"]
@@ -671,25 +1412,9 @@ def create_app():
             return redirect(url_for("index"))
 
         try:
-            # 1) Open the spreadsheet
-            client = init_sheet_client_from_dict(sa_info)
-            sh = client.open_by_key(sheet_id)
-
-            # 2) Build a header row with every field you poll
-            all_tags = list(static_commands.values()) + list(dynamic_commands.values())
-            all_q600 = list(q600_variables.keys())
-            header = ["Timestamp"] + all_tags + all_q600
-
-            # 3) Create the worksheet with exactly enough columns
-            sh.add_worksheet(
-                title=machine,
-                rows="1000",
-                cols=str(len(header))
-            )
-            ws = sh.worksheet(machine)
-
-            # 4) Write the header row
-            ws.append_row(header)
+            # Create the worksheet with one column per polled field
+            header = sheet_header()
+            sheets_client(log_cfg).add_tab(machine, header)
 
             flash(f"Created tab “{machine}” with {len(header)} columns.", "success")
 
@@ -0,0 +1,81 @@
+import queue
+import threading
+import time
+
+
+class BatchWriter:
+    """
+    Background writer for poll rows.
+
+    The poller hands rows to put(), which never blocks: rows go onto a
+    bounded queue and a dedicated thread passes them to `write(batch)` in
+    batches, flushed when `batch_size` rows are waiting or `flush_interval`
+    seconds have passed. When the queue is full the row is dropped and
+    counted instead of stalling the serial loop.
+    """
+
+    def __init__(self, write, name="WRITER", batch_size=500, flush_interval=2.0, max_queue=10000):
+        self.write = write
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failures = 0
+        self.max_depth = 0
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, row):
+        """
+        Queue one row. Returns False if it was dropped.
+        """
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                print(f"[{self.name}] Writer queue full, {self.dropped} row(s) dropped")
+            return False
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def stats(self):
+        return {
+            "queued":    self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "written":   self.written,
+            "dropped":   self.dropped,
+            "batches":   self.batches,
+            "failures":  self.failures
+        }
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self.write(batch)
+                self.written += len(batch)
+                self.batches += 1
+            except Exception as e:
+                self.failures += 1
+                self.last_error = e
+                print(f"[{self.name}] Failed to write {len(batch)} row(s): {e}")
@@ -0,0 +1,360 @@
+"""
+Benchmarks against the simulated controller in haas_sim.py, so poll cycle
+time and drip-feed throughput can be measured without a real Haas.
+
+    python benchmarks/bench.py                 # everything
+    python benchmarks/bench.py --quick         # shorter runs
+    python benchmarks/bench.py --only commands,cycle
+
+  commands  Q-commands/second through send_q_command, stop-and-wait and
+            pipelined (query_many) macro reads
+  cycle     one full poll cycle (every group of build_poll_groups) for
+            several q600_selected plans
+  send      end-to-end /send drip-feed: lines/sec and bytes/sec
+  web       route latency while the monitor is polling and a send runs
+  startup   import + create_app() time in a fresh interpreter, checked
+            against --startup-budget; also fails if a back-end library
+            (SQLAlchemy, pyodbc, gspread, oauth2client) got imported
+
+Each run is saved to benchmarks/results/<time>-<git rev>.json and compared
+with the previous saved run, so regressions in send_q_command,
+monitor_loop or serial_sender show up as a slower number.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+RESULTS_DIR = os.path.join(HERE, "results")
+sys.path.insert(0, ROOT)
+
+import serial
+
+from haas_sim import HaasSimulator
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def open_port(sim):
+    return serial.Serial(sim.port, 115200, timeout=1, xonxoff=True)
+
+
+# ----- benchmarks -----
+
+def bench_commands(args, results):
+    import app
+    sim = HaasSimulator(args.latency, args.jitter, seed=1).start()
+    try:
+        with open_port(sim) as ser:
+            for cmd in ("?Q104", "?Q500"):
+                count, start = 0, time.monotonic()
+                while time.monotonic() - start < args.seconds:
+                    app.send_q_command(ser, cmd)
+                    count += 1
+                results[f"commands.{cmd[1:]}_per_s"] = count / (time.monotonic() - start)
+
+            macros = [f"?{c}" for c in range(1601, 1801)]
+            start = time.monotonic()
+            for cmd in macros:
+                app.send_q_command(ser, cmd)
+            results["commands.macro_stop_and_wait_per_s"] = len(macros) / (time.monotonic() - start)
+
+            transport = app.get_transport(ser.port)
+            start = time.monotonic()
+            replies = transport.query_many(ser, macros)
+            results["commands.macro_pipelined_per_s"] = len(macros) / (time.monotonic() - start)
+            results["commands.macro_pipelined_missing"] = sum(1 for r in replies if not r)
+    finally:
+        sim.close()
+
+def bench_cycle(args, results):
+    import app
+    scalars = [k for k, v in app.q600_variables.items() if not isinstance(v[0], list)]
+    tables = [k for k, v in app.q600_variables.items() if isinstance(v[0], list)]
+    plans = {
+        "none":      [],
+        "scalars":   scalars,
+        "one_table": scalars + tables[:1],
+        "all":       scalars + tables,
+    }
+    sim = HaasSimulator(args.latency, args.jitter, seed=2).start()
+    try:
+        with open_port(sim) as ser:
+            transport = app.get_transport(ser.port)
+            for name, labels in plans.items():
+                groups = app.build_poll_groups({"polling_rate": 5}, labels)
+                durations = []
+                for _ in range(args.cycles):
+                    start = time.monotonic()
+                    for group in groups:
+                        commands = [cmd for cmd, _ in group.commands]
+                        if group.bulk:
+                            transport.query_many(ser, commands)
+                        else:
+                            for cmd in commands:
+                                app.send_q_command(ser, cmd)
+                    durations.append(time.monotonic() - start)
+                n = sum(len(g.commands) for g in groups)
+                results[f"cycle.{name}.commands"] = n
+                results[f"cycle.{name}.mean_s"] = sum(durations) / len(durations)
+                results[f"cycle.{name}.p95_s"] = percentile(durations, 0.95)
+    finally:
+        sim.close()
+
+def make_program(path, lines):
+    with open(path, "w") as f:
+        f.write("%\nO01234 (BENCH)\n")
+        for i in range(lines):
+            f.write(f"G01 X{i % 100}.{i % 10} Y{i % 37}.5 F{100 + i % 50}.\n")
+        f.write("M30\n%\n")
+
+BACKEND_MODULES = ("sqlalchemy", "pyodbc", "gspread", "oauth2client")
+
+STARTUP_SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+print(json.dumps({{
+    "import_s": imported - started,
+    "create_app_s": created - imported,
+    "backends": [m for m in {modules!r} if m in sys.modules],
+}}))
+"""
+
+def write_gateway_config(sim, workdir):
+    """
+    machines.json etc. in `workdir` for one machine on the simulator's port.
+    """
+    os.makedirs(os.path.join(workdir, "sim"), exist_ok=True)
+    with open(os.path.join(workdir, "machines.json"), "w") as f:
+        json.dump({"machines": [{"id": "sim", "config_dir": "sim",
+                                 "upload_folder": "uploads/sim"}]}, f)
+    with open(os.path.join(workdir, "sim", "serial_config.json"), "w") as f:
+        json.dump({"port": sim.port, "baudrate": 115200, "bytesize": 8,
+                   "parity": "None", "stopbits": 1}, f)
+    with open(os.path.join(workdir, "sim", "machine_info.json"), "w") as f:
+        json.dump({"name": "Simulated", "polling_rate": 1}, f)
+
+def start_gateway(sim, workdir):
+    """
+    create_app() in `workdir` with one machine on the simulator's port.
+    """
+    write_gateway_config(sim, workdir)
+    os.chdir(workdir)
+    import app
+    gateway = app.create_app()
+    app.monitor_log.echo = False
+    return gateway
+
+def run_send(client, sim, path):
+    with open(path, "rb") as f:
+        client.post("/?machine=sim", data={"file": (f, "O01234.nc")},
+                    content_type="multipart/form-data")
+    before = sim.stats["program_lines"]
+    client.get("/send/O01234.nc?machine=sim")
+    while True:
+        jobs = client.get("/api/jobs?machine=sim").get_json()
+        job = max(jobs, key=lambda j: j["id"]) if jobs else None
+        if job and job["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.05)
+    # the port's buffers may still be draining into the simulator
+    received = None
+    while received != sim.stats["program_lines"]:
+        received = sim.stats["program_lines"]
+        time.sleep(0.2)
+    return job, received - before
+
+def bench_send_and_web(args, results, only):
+    sim = HaasSimulator(args.latency, args.jitter, xoff_every=args.xoff_every, seed=3).start()
+    workdir = tempfile.mkdtemp(prefix="cnc-bench-")
+    cwd = os.getcwd()
+    try:
+        gateway = start_gateway(sim, workdir)
+        client = gateway.test_client()
+        program = os.path.join(workdir, "bench.nc")
+        make_program(program, args.lines)
+        # let the monitor finish its first (static) cycle
+        time.sleep(1.0)
+
+        if "send" in only:
+            job, received = run_send(client, sim, program)
+            results["send.status"] = job["status"]
+            results["send.lines"] = job["lines"]
+            results["send.lines_received"] = received
+            results["send.lines_per_s"] = job["lines_per_sec"]
+            results["send.bytes_per_s"] = job["bytes_per_sec"]
+
+        if "web" in only:
+            routes = ["/?machine=sim", "/livepolling?machine=sim", "/api/live?machine=sim",
+                      "/api/jobs?machine=sim", "/api/analytics?machine=sim"]
+            timings = {r: [] for r in routes}
+            stop = threading.Event()
+
+            def worker():
+                c = gateway.test_client()
+                while not stop.is_set():
+                    for route in routes:
+                        start = time.monotonic()
+                        c.get(route)
+                        timings[route].append(time.monotonic() - start)
+
+            threads = [threading.Thread(target=worker) for _ in range(args.clients)]
+            for t in threads:
+                t.start()
+            # load the serial lock too: a drip-feed competes with the monitor
+            if "send" in only:
+                run_send(client, sim, program)
+            else:
+                time.sleep(args.seconds)
+            stop.set()
+            for t in threads:
+                t.join()
+            for route, values in timings.items():
+                key = route.split("?")[0].strip("/").replace("/", "_") or "index"
+                results[f"web.{key}.p50_ms"] = percentile(values, 0.5) * 1000
+                results[f"web.{key}.p95_ms"] = percentile(values, 0.95) * 1000
+    finally:
+        os.chdir(cwd)
+        sim.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_startup(args, results):
+    sim = HaasSimulator(args.latency, args.jitter, seed=4).start()
+    workdir = tempfile.mkdtemp(prefix="cnc-bench-")
+    try:
+        write_gateway_config(sim, workdir)
+        snippet = STARTUP_SNIPPET.format(root=ROOT, modules=BACKEND_MODULES)
+        runs = []
+        for _ in range(args.cycles):
+            start = time.monotonic()
+            out = subprocess.check_output([sys.executable, "-c", snippet], cwd=workdir,
+                                          stderr=subprocess.DEVNULL)
+            run = json.loads(out.decode().strip().splitlines()[-1])
+            run["total_s"] = time.monotonic() - start
+            runs.append(run)
+        for key in ("import_s", "create_app_s", "total_s"):
+            results[f"startup.{key}"] = percentile([r[key] for r in runs], 0.5)
+        results["startup.backends_imported"] = ",".join(runs[-1]["backends"]) or "none"
+    finally:
+        sim.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def check_startup(args, results):
+    """
+    Problems with the startup numbers, if any.
+    """
+    problems = []
+    if results["startup.total_s"] > args.startup_budget:
+        problems.append(f"startup took {results['startup.total_s']:.2f}s, "
+                        f"budget is {args.startup_budget:.2f}s")
+    if results["startup.backends_imported"] != "none":
+        problems.append(f"back-end libraries imported at startup: "
+                        f"{results['startup.backends_imported']}")
+    return problems
+
+
+# ----- results -----
+
+def previous_result():
+    files = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+    if not files:
+        return None
+    with open(files[-1]) as f:
+        return json.load(f)
+
+def save_result(record):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{record['meta']['git_rev']}.json"
+    path = os.path.join(RESULTS_DIR, name)
+    with open(path, "w") as f:
+        json.dump(record, f, indent=2, sort_keys=True)
+    return path
+
+def report(results, previous):
+    old = previous["results"] if previous else {}
+    if previous:
+        print(f"Compared with {previous['meta']['git_rev']} ({previous['meta']['time']})")
+    for key in sorted(results):
+        value = results[key]
+        line = f"  {key:<40} {value:>12.3f}" if isinstance(value, float) else f"  {key:<40} {value!s:>12}"
+        before = old.get(key)
+        if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before:
+            line += f"   was {before:.3f} ({(value - before) / before * 100:+.1f}%)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the gateway against a simulated Haas.")
+    parser.add_argument("--only", default="commands,cycle,send,web,startup")
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.01, help="simulated reply latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--xoff-every", type=int, default=4096)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent web clients")
+    parser.add_argument("--startup-budget", type=float, default=3.0,
+                        help="max seconds from interpreter start to create_app() returning")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+    args.seconds = 1.0 if args.quick else 5.0
+    args.cycles = 2 if args.quick else 5
+    args.lines = 2000 if args.quick else 20000
+    only = set(args.only.split(","))
+
+    results = {}
+    if "commands" in only:
+        bench_commands(args, results)
+    if "cycle" in only:
+        bench_cycle(args, results)
+    if "startup" in only:
+        bench_startup(args, results)
+    if only & {"send", "web"}:
+        bench_send_and_web(args, results, only)
+
+    record = {
+        "meta": {
+            "git_rev": git_rev(),
+            "time":    datetime.now().isoformat(timespec="seconds"),
+            "python":  platform.python_version(),
+            "args":    vars(args),
+        },
+        "results": results,
+    }
+    report(results, previous_result())
+    if not args.no_save:
+        print(f"Saved {save_result(record)}")
+    problems = check_startup(args, results) if "startup" in only else []
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+A simulated Haas controller on a pseudo-terminal.
+
+Answers Q100-Q500 and macro reads ("?Q600 3026" or our "?3026") with
+STX ... CRLF ETB framed replies after a configurable latency and jitter,
+can drop a fraction of replies, and swallows drip-fed program lines,
+pausing the sender with XOFF/XON every `xoff_every` bytes like a
+controller whose buffer fills up.
+
+    sim = HaasSimulator(latency=0.02).start()
+    ser = serial.Serial(sim.port, 115200, timeout=1, xonxoff=True)
+    ...
+    sim.close()
+
+Run directly (python benchmarks/haas_sim.py) to leave one up for manual
+testing; it prints the port to put in serial_config.json.
+"""
+import argparse
+import os
+import pty
+import random
+import re
+import threading
+import time
+import tty
+
+STX = b"\x02"
+ETB = b"\x17"
+XON = b"\x11"
+XOFF = b"\x13"
+
+QUERY_RE = re.compile(r'^\?\s*(?:Q(\d+))?\s*(\d+)?\s*$', re.IGNORECASE)
+
+
+def _hms(seconds, hour_digits=5):
+    seconds = int(seconds)
+    return f"{seconds // 3600:0{hour_digits}d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class HaasSimulator:
+    """
+    Fake controller thread serving one pty. `port` is the device path a
+    client opens; `stats` counts what it saw.
+
+    The machine "runs" a `cycle_time` second program from start(): power-on,
+    motion and cycle timers and the M30 counters advance with the wall clock,
+    so the analytics see plausible data.
+    """
+
+    def __init__(self, latency=0.02, jitter=0.01, drop_rate=0.0, xoff_every=0,
+                 xoff_pause=0.05, cycle_time=60.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.xoff_every = xoff_every
+        self.xoff_pause = xoff_pause
+        self.cycle_time = cycle_time
+        self.random = random.Random(seed)
+        self.macros = {}
+        self.stats = {"queries": 0, "replies": 0, "dropped": 0,
+                      "program_lines": 0, "program_bytes": 0, "xoff": 0}
+
+        self.master, self._slave = pty.openpty()
+        # no echo/line editing until the client configures the port itself
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._since_xoff = 0
+        self._started = None
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="haas-sim", daemon=True)
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed.set()
+        for fd in (self.master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def reset_stats(self):
+        for key in self.stats:
+            self.stats[key] = 0
+
+    # ----- replies -----
+
+    def macro(self, number):
+        return self.macros.get(number, (number % 97) / 10.0)
+
+    def answer(self, code, number):
+        up = time.monotonic() - self._started
+        cycles = int(up // self.cycle_time)
+        if code == 600 or (code is None and number is not None):
+            return f"MACRO, {number}, {self.macro(number):.6f}"
+        return {
+            100: "SERIAL NUMBER, 1234567",
+            101: "SOFTWARE VERSION, 100.20.000.1010",
+            102: "MODEL, VF2SS",
+            104: "MODE, MEM",
+            200: f"TOOL CHANGES, {120 + cycles * 3}",
+            201: f"USING TOOL, {cycles % 20 + 1}",
+            300: f"P.O. TIME, {_hms(100000 + up)}",
+            301: f"C.S. TIME, {_hms(60000 + up * 0.8)}",
+            303: f"LAST CYCLE, {_hms(self.cycle_time, 3)}",
+            304: f"PREV CYCLE, {_hms(self.cycle_time, 3)}",
+            402: f"M30 #1, {cycles}",
+            403: f"M30 #2, {cycles}",
+            500: f"PROGRAM, O01234, {'RUN' if up % self.cycle_time < self.cycle_time * 0.8 else 'IDLE'}, PARTS, {cycles}",
+        }.get(code, "UNKNOWN COMMAND")
+
+    def _write(self, data):
+        try:
+            os.write(self.master, data)
+        except OSError:
+            self._closed.set()
+
+    def _handle(self, line):
+        text = line.decode("ascii", errors="ignore").strip()
+        if not text:
+            return
+        m = QUERY_RE.match(text)
+        if m is None and text[:1].upper() == "Q" and text[1:].isdigit():
+            m = QUERY_RE.match("?" + text)
+        if m is None:
+            # a drip-fed program line
+            self.stats["program_lines"] += 1
+            self.stats["program_bytes"] += len(line) + 2
+            if self.xoff_every:
+                self._since_xoff += len(line) + 2
+                if self._since_xoff >= self.xoff_every:
+                    self._since_xoff = 0
+                    self.stats["xoff"] += 1
+                    self._write(XOFF)
+                    time.sleep(self.xoff_pause)
+                    self._write(XON)
+            return
+
+        self.stats["queries"] += 1
+        code = int(m.group(1)) if m.group(1) else None
+        number = int(m.group(2)) if m.group(2) else None
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.random.random() < self.drop_rate:
+            self.stats["dropped"] += 1
+            return
+        self._write(STX + self.answer(code, number).encode("ascii") + b"\r\n" + ETB)
+        self.stats["replies"] += 1
+
+    def _run(self):
+        pending = b""
+        while not self._closed.is_set():
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            if not data:
+                continue
+            pending += data.replace(b"\n", b"\r")
+            *lines, pending = pending.split(b"\r")
+            for line in lines:
+                self._handle(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a simulated Haas controller on a pty.")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--xoff-every", type=int, default=0)
+    parser.add_argument("--xoff-pause", type=float, default=0.05)
+    args = parser.parse_args()
+
+    sim = HaasSimulator(args.latency, args.jitter, args.drop_rate,
+                        args.xoff_every, args.xoff_pause).start()
+    print(f"Simulated Haas on {sim.port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(10)
+            print(sim.stats)
+    except KeyboardInterrupt:
+        sim.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import threading
+import time
+
+
+def as_number(value):
+    """
+    Float value of a reading, or None if it isn't numeric. Replies of the
+    form "LABEL, 12.5" use their last comma-separated field.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    if isinstance(value, str) and "," in value:
+        try:
+            return float(value.rsplit(",", 1)[1])
+        except ValueError:
+            pass
+    return None
+
+
+class ChangeFilter:
+    """
+    Decides which readings are worth persisting.
+
+    A reading is stored when its tag is new, when its value changed (for
+    numbers: moved more than the tag's deadband away from the last stored
+    value), or when `heartbeat` seconds passed since the tag was last stored,
+    so an unchanged value is still re-confirmed periodically.
+    """
+
+    def __init__(self, deadbands=None, default_deadband=0.0, heartbeat=900):
+        self.deadbands = dict(deadbands or {})
+        self.default_deadband = default_deadband
+        self.heartbeat = heartbeat
+        self.stored = 0
+        self.suppressed = 0
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def _changed(self, tag, old, new):
+        old_num, new_num = as_number(old), as_number(new)
+        if old_num is None or new_num is None:
+            return old != new
+        band = self.deadbands.get(tag, self.default_deadband)
+        if band <= 0:
+            return old_num != new_num
+        return abs(new_num - old_num) > band
+
+    def should_store(self, tag, value, now=None):
+        """
+        True if (tag, value) should be written; remembers it as the last stored value.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            last = self._last.get(tag)
+            if (last is None
+                    or self._changed(tag, last[0], value)
+                    or (self.heartbeat and now - last[1] >= self.heartbeat)):
+                self._last[tag] = (value, now)
+                self.stored += 1
+                return True
+            self.suppressed += 1
+            return False
+
+    def forget(self, tag=None):
+        """
+        Drop remembered values (one tag or all) so the next reading is stored.
+        """
+        with self._lock:
+            if tag is None:
+                self._last.clear()
+            else:
+                self._last.pop(tag, None)
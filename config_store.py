@@ -0,0 +1,149 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def atomic_write_json(path, data):
+    """
+    Replace `path` with `data` as JSON so that a crash or power cut leaves
+    either the old file or the new one, never a truncated mix: write a temp
+    file in the same directory, fsync it, rename it over `path`, then fsync
+    the directory so the rename itself is durable.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class ConfigStore:
+    """
+    JSON config files kept in memory.
+
+    load() serves the cached copy and only re-reads a file when its mtime
+    or size changed, checking at most every `check_interval` seconds. save()
+    writes atomically. Subscribers of a path are called with (path, data)
+    after every save and, via a watcher thread started on the first
+    subscribe(), when the file is edited by hand.
+
+    Callers always get their own copy, so mutating a loaded dict doesn't
+    change what others see until it is saved.
+    """
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._cache = {}        # path -> [signature, data, last_checked]
+        self._subscribers = {}  # path -> [callback, ...]
+        self._lock = threading.RLock()
+        self._watcher = None
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read(self, path, entry):
+        """
+        Refresh the cache entry for `path` from disk. True if it changed.
+        """
+        signature = self._signature(path)
+        entry[2] = time.monotonic()
+        if signature == entry[0]:
+            return False
+        if signature is None:
+            entry[0], entry[1] = None, None
+            return True
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            # keep serving the last good copy (or the default)
+            print(f"[CONFIG] Ignoring unreadable {path}: {e}")
+            entry[0] = signature
+            return False
+        entry[0], entry[1] = signature, data
+        return True
+
+    def load(self, path, default=None):
+        """
+        Contents of `path`, or a copy of `default` if it doesn't exist.
+        """
+        with self._lock:
+            entry = self._cache.get(path)
+            if entry is None:
+                entry = self._cache[path] = [None, None, 0.0]
+                self._read(path, entry)
+            elif time.monotonic() - entry[2] >= self.check_interval:
+                self._read(path, entry)
+            data = entry[1]
+        return copy.deepcopy(default if data is None else data)
+
+    def save(self, path, data):
+        """
+        Atomically write `data` to `path` and notify its subscribers.
+        """
+        with self._lock:
+            atomic_write_json(path, data)
+            self._cache[path] = [self._signature(path), copy.deepcopy(data), time.monotonic()]
+        self._notify(path, data)
+
+    def subscribe(self, path, callback):
+        """
+        Call `callback(path, data)` whenever `path` is saved or edited.
+        """
+        with self._lock:
+            self._subscribers.setdefault(path, []).append(callback)
+            if path not in self._cache:
+                self._cache[path] = [None, None, 0.0]
+                self._read(path, self._cache[path])
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="config-watch",
+                                                 daemon=True)
+                self._watcher.start()
+
+    def _notify(self, path, data):
+        for callback in list(self._subscribers.get(path, [])):
+            try:
+                callback(path, copy.deepcopy(data))
+            except Exception as e:
+                print(f"[CONFIG] Subscriber for {path} failed: {e}")
+
+    def _watch(self):
+        while True:
+            time.sleep(max(self.check_interval, 1.0))
+            for path in list(self._subscribers):
+                with self._lock:
+                    entry = self._cache[path]
+                    changed = self._read(path, entry)
+                    data = entry[1]
+                if changed and data is not None:
+                    print(f"[CONFIG] {path} changed on disk")
+                    self._notify(path, data)
+
+
+# the process-wide store used by the app and the serial connections
+STORE = ConfigStore()
@@ -0,0 +1,173 @@
+"""
+Plumbing for running the gateway as one hardware service plus any number
+of web workers.
+
+Exactly one process may own the serial ports: whoever holds the LeaderLock.
+It exposes a table of named operations (latest readings, live feed, sends,
+queries, ...) on a local Unix socket through ServiceServer; web workers call
+them with ServiceClient. LocalGateway offers the same call() interface
+in-process, so routes don't care which side of the socket they are on.
+"""
+import fcntl
+import json
+import os
+import socket
+import socketserver
+import threading
+
+
+class ServiceError(RuntimeError):
+    """
+    An operation failed in the service, or the service can't be reached.
+    """
+
+
+class LeaderLock:
+    """
+    An flock() on `path`; the OS drops it when the holder exits, however it
+    exits, so a crashed service never leaves a stale lock behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self, block=False):
+        """
+        Take the lock; with `block`, wait for the current holder to go away.
+        Returns False if someone else holds it.
+        """
+        f = open(self.path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if block else fcntl.LOCK_NB))
+        except BlockingIOError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(f"{os.getpid()}\n")
+        f.flush()
+        self._file = f
+        return True
+
+    def holder(self):
+        """
+        Pid written by the current holder, if any.
+        """
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # one JSON request per line: {"op": name, "args": {...}}, answered by
+    # {"result": ...} or {"error": "..."}
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                op = self.server.handlers.get(request.get("op"))
+                if op is None:
+                    raise ServiceError(f"unknown operation {request.get('op')!r}")
+                reply = {"result": op(**request.get("args", {}))}
+            except Exception as e:
+                reply = {"error": str(e) or type(e).__name__}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+
+class ServiceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves `handlers` ({name: function(**args)}) on the Unix socket `path`,
+    one thread per connected client. Only start it while holding the
+    LeaderLock: a socket file left by a previous holder is removed.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, handlers):
+        self.handlers = handlers
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o660)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="gateway-service", daemon=True).start()
+        return self
+
+
+class ServiceClient:
+    """
+    Calls operations on the service over its socket. Each thread keeps its
+    own connection, so a long-polling live-feed viewer doesn't hold up the
+    other requests of the worker.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock, sock.makefile("rb")
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    def call(self, op, timeout=None, retry=True, **args):
+        """
+        Run `op` in the service and return its result. A connection left
+        over from before a service restart is reopened once, unless `retry`
+        is False (for operations that must not run twice, like a send).
+        """
+        payload = json.dumps({"op": op, "args": args}).encode() + b"\n"
+        for attempt in (0, 1):
+            reused = getattr(self._local, "conn", None) is not None
+            try:
+                if not reused:
+                    self._local.conn = self._connect()
+                sock, reader = self._local.conn
+                sock.settimeout(timeout or self.timeout)
+                sock.sendall(payload)
+                line = reader.readline()
+                if not line:
+                    raise ConnectionResetError("service closed the connection")
+                break
+            except OSError as e:
+                self._close()
+                if attempt or not reused or not retry:
+                    raise ServiceError(f"gateway service unavailable: {e}") from e
+        reply = json.loads(line)
+        if "error" in reply:
+            raise ServiceError(reply["error"])
+        return reply["result"]
+
+
+class LocalGateway:
+    """
+    The ServiceClient interface for a process that owns the hardware itself.
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+
+    def call(self, op, timeout=None, retry=True, **args):
+        handler = self.handlers.get(op)
+        if handler is None:
+            raise ServiceError(f"unknown operation {op!r}")
+        return handler(**args)
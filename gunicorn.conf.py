@@ -0,0 +1,20 @@
+# Web workers for the split serving mode (run service.py alongside):
+#
+#     gunicorn -c gunicorn.conf.py 'app:create_app("web")'
+#
+# Threaded workers, not gunicorn's default sync ones: every open live page
+# keeps a /api/live/stream request running for as long as it is open, and
+# a sync worker would spend itself on one such viewer (and be killed by
+# the request timeout). Each thread holds one viewer or one page request,
+# so capacity is workers x threads concurrent requests.
+import os
+
+bind = os.environ.get("CNC_GATEWAY_BIND", "0.0.0.0:8080")
+workers = int(os.environ.get("CNC_GATEWAY_WORKERS", 4))
+worker_class = "gthread"
+threads = int(os.environ.get("CNC_GATEWAY_THREADS", 16))
+# gthread workers heartbeat independently of requests, so long-lived
+# streams don't trip this
+timeout = 30
+# live streams never finish on their own; don't hold a restart up for them
+graceful_timeout = 5
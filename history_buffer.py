@@ -0,0 +1,115 @@
+import math
+import threading
+from array import array
+
+from change_filter import as_number
+
+
+class TagHistory:
+    """
+    Fixed-size ring buffer of (epoch seconds, float) samples for one tag.
+
+    Storage is two preallocated array('d') columns, so memory is 16 bytes per
+    slot regardless of how many samples have been written.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.start = 0
+        self.count = 0
+
+    def append(self, ts, value):
+        end = (self.start + self.count) % self.capacity
+        self.times[end] = ts
+        self.values[end] = value
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def _slot(self, i):
+        return (self.start + i) % self.capacity
+
+    def _bisect(self, ts):
+        # first logical index whose time is >= ts (samples are in time order)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self._slot(mid)] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start=None, end=None):
+        """
+        Samples with start <= ts <= end as a list of (ts, value).
+        """
+        lo = 0 if start is None else self._bisect(start)
+        hi = self.count if end is None else self._bisect(math.nextafter(end, math.inf))
+        return [(self.times[self._slot(i)], self.values[self._slot(i)]) for i in range(lo, hi)]
+
+    def downsample(self, start, end, points):
+        """
+        Split [start, end] into `points` equal buckets and return
+        (bucket_start, min, max, avg, last) for every non-empty bucket.
+        """
+        width = (end - start) / points
+        buckets = []
+        current = None
+        for ts, value in self.range(start, end):
+            b = min(int((ts - start) / width), points - 1)
+            if current is None or current[0] != b:
+                current = [b, value, value, 0.0, 0, value]
+                buckets.append(current)
+            current[1] = min(current[1], value)
+            current[2] = max(current[2], value)
+            current[3] += value
+            current[4] += 1
+            current[5] = value
+        return [(start + b * width, lo, hi, total / n, last)
+                for b, lo, hi, total, n, last in buckets]
+
+
+class HistoryStore:
+    """
+    One TagHistory per tag, sized to hold `window` seconds at the tag's poll
+    period (capped at `max_capacity` slots); tags polled only once get a few
+    slots. Non-numeric readings are skipped.
+    """
+
+    def __init__(self, window=24 * 3600, max_capacity=86400):
+        self.window = window
+        self.max_capacity = max_capacity
+        self.tags = {}
+        self._lock = threading.Lock()
+
+    def capacity_for(self, period):
+        if not period:
+            return 16
+        return max(2, min(self.max_capacity, math.ceil(self.window / period) + 1))
+
+    def record(self, tag, ts, value, period=None):
+        """
+        Add a reading; `period` (seconds) sizes the buffer the first time a tag is seen.
+        """
+        number = as_number(value)
+        if number is None:
+            return
+        with self._lock:
+            hist = self.tags.get(tag)
+            if hist is None:
+                hist = self.tags[tag] = TagHistory(self.capacity_for(period))
+            hist.append(ts, number)
+
+    def range(self, tag, start=None, end=None):
+        with self._lock:
+            hist = self.tags.get(tag)
+            return hist.range(start, end) if hist else []
+
+    def downsample(self, tag, start, end, points):
+        with self._lock:
+            hist = self.tags.get(tag)
+            return hist.downsample(start, end, points) if hist else []
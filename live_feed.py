@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import deque
+
+
+class LiveFeed:
+    """
+    Sequence-numbered stream of tag changes for the live polling page.
+
+    The poller publishes every reading; only values that differ from the
+    tag's previous one get a new sequence number. Viewers wait for anything
+    newer than the last sequence they saw, so a reconnecting client resumes
+    where it left off, or gets a full snapshot if it fell out of the window.
+
+    Sequence numbers restart with the process, so each feed also has a
+    random `epoch`; a client whose last event came from another epoch gets
+    a snapshot rather than resuming at a number that means something else.
+    """
+
+    def __init__(self, keep=5000):
+        self.epoch = os.urandom(4).hex()
+        self.seq = 0
+        self.latest = {}
+        self.events = deque(maxlen=keep)
+        self._cond = threading.Condition()
+
+    def publish(self, tag, value, timestamp):
+        """
+        Record a reading; returns True if it was a change viewers will see.
+        """
+        with self._cond:
+            current = self.latest.get(tag)
+            if current is not None and current["value"] == value:
+                current["timestamp"] = timestamp
+                return False
+            self.seq += 1
+            entry = {"seq": self.seq, "tag": tag, "value": value, "timestamp": timestamp}
+            self.latest[tag] = entry
+            self.events.append(entry)
+            self._cond.notify_all()
+            return True
+
+    def snapshot(self):
+        with self._cond:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {"epoch": self.epoch, "seq": self.seq,
+                "readings": [dict(e) for e in self.latest.values()]}
+
+    def since(self, seq, timeout=None, epoch=None):
+        """
+        Wait up to `timeout` for changes after `seq`.
+
+        Returns (kind, payload): ("events", [...]) with the newer changes
+        (possibly empty on timeout), or ("snapshot", {...}) if `seq` is older
+        than the retained window, from another `epoch`, or newer than this
+        feed has got (the client last saw a feed from before a restart).
+        """
+        with self._cond:
+            if seq > self.seq or (epoch is not None and epoch != self.epoch):
+                return "snapshot", self._snapshot()
+            if self.seq == seq:
+                self._cond.wait(timeout)
+            if self.seq <= seq:
+                return "events", []
+            if not self.events or self.events[0]["seq"] > seq + 1:
+                return "snapshot", self._snapshot()
+            # events are seq-ordered; walk back from the newest
+            newer = []
+            for e in reversed(self.events):
+                if e["seq"] <= seq:
+                    break
+                newer.append(dict(e))
+            newer.reverse()
+            return "events", newer
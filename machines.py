@@ -0,0 +1,70 @@
+import os
+
+from analytics import MachineAnalytics
+from config_store import STORE
+from history_buffer import HistoryStore
+from live_feed import LiveFeed
+from poll_scheduler import PollPlan
+from program_index import ProgramIndex
+from rules import RuleEngine
+from serial_link import get_connection
+
+# The original single-machine layout: config files in the app directory
+DEFAULT_REGISTRY = {
+    "machines": [
+        {"id": "haas1", "config_dir": ".", "upload_folder": "uploads/haas1"}
+    ]
+}
+
+
+def load_registry(path):
+    """
+    Read the machine registry, falling back to the single-machine default.
+    """
+    return STORE.load(path, DEFAULT_REGISTRY)
+
+def save_registry(path, registry):
+    STORE.save(path, registry)
+
+
+class Machine:
+    """
+    Everything that belongs to one CNC on the gateway: where its config
+    files live, its serial connection, program library and live data.
+
+    Each machine gets its own connection and monitor thread, so a slow or
+    unplugged machine only ever delays itself. Web workers of the split
+    serving mode build it with `hardware=False`: config and program library
+    only, the rest lives in the gateway service.
+    """
+
+    def __init__(self, entry, serial_config, info, hardware=True):
+        self.id = entry["id"]
+        self.config_dir = entry.get("config_dir", os.path.join("machines", self.id))
+        self.upload_folder = entry.get("upload_folder", os.path.join("uploads", self.id))
+        os.makedirs(self.config_dir, exist_ok=True)
+
+        self.serial_config_path = os.path.join(self.config_dir, "serial_config.json")
+        self.info_path = os.path.join(self.config_dir, "machine_info.json")
+        self.q600_path = os.path.join(self.config_dir, "q600_config.json")
+        self.rules_path = os.path.join(self.config_dir, "rules.json")
+
+        self.serial_config = serial_config
+        self.info = info
+        self.program_index = ProgramIndex(self.upload_folder)
+        if not hardware:
+            return
+        self.serial_conn = get_connection(serial_config, self.serial_config_path, key=self.id)
+        self.latest_readings = {}
+        self.history = HistoryStore()
+        self.live_feed = LiveFeed()
+        # shift start hours, e.g. [6, 14, 22]
+        self.analytics = MachineAnalytics(info.get("shift_starts", (6, 14, 22)))
+        # alert rules, loaded from rules.json by the monitor
+        self.rules = RuleEngine()
+        self.send_jobs = {}
+        self.poll_plan = PollPlan()
+
+    @property
+    def name(self):
+        return self.info.get("name", self.id)
@@ -0,0 +1,115 @@
+import atexit
+import gzip
+import os
+import shutil
+import threading
+import time
+
+
+def tail_lines(path, n, block_size=4096):
+    """
+    Last `n` lines of a text file, read backwards from the end in blocks so
+    the cost doesn't grow with the file.
+    """
+    if n <= 0 or not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = data.decode("utf-8", errors="replace").splitlines(keepends=True)
+    return lines[-n:]
+
+
+class BufferedLog:
+    """
+    Append-only text log that batches writes in memory.
+
+    A background thread (started on first write) flushes the buffer every
+    `flush_interval` seconds through one file handle kept open, and once
+    more when the interpreter exits. The file is
+    rotated when it exceeds `max_bytes` or is older than `max_age` seconds;
+    old segments are gzip-compressed as <path>.1.gz ... <path>.<backups>.gz.
+    """
+
+    def __init__(self, path, max_bytes=5 * 1024 * 1024, max_age=24 * 3600,
+                 backups=5, flush_interval=2.0, echo=True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.echo = echo
+        self._pending = []
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._file = None
+        self._segment_started = None
+        self._thread = None
+
+    def write(self, line):
+        if self.echo:
+            print(line)
+        with self._lock:
+            self._pending.append(line + "\n")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                # the flusher is a daemon; write out what's left on exit
+                atexit.register(self._flush_at_exit)
+
+    def tail(self, n):
+        """
+        Last `n` lines, including ones not flushed to disk yet.
+        """
+        with self._io_lock:
+            with self._lock:
+                pending = list(self._pending[-n:])
+            if len(pending) >= n:
+                return pending
+            return tail_lines(self.path, n - len(pending)) + pending
+
+    def flush(self):
+        with self._io_lock:
+            with self._lock:
+                lines, self._pending = self._pending, []
+            if not lines:
+                return
+            if self._file is None:
+                self._file = open(self.path, "a")
+                self._segment_started = time.time()
+            self._file.write("".join(lines))
+            self._file.flush()
+            if (self._file.tell() >= self.max_bytes
+                    or time.time() - self._segment_started >= self.max_age):
+                self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}.gz"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}.gz")
+        with open(self.path, "rb") as src, gzip.open(f"{self.path}.1.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(self.path)
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except OSError as e:
+            print(f"[LOG] Could not write {self.path}: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"[LOG] Could not write {self.path}: {e}")
@@ -0,0 +1,175 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class PollGroup:
+    """
+    A set of (command, tag) pairs polled together every `period` seconds.
+
+    `period` may be a number, a zero-argument callable returning one (so a
+    setting like polling_rate can change at runtime), or None to poll once.
+    `bulk` groups (Q600 ranges) are read with pipelined requests.
+    """
+
+    def __init__(self, name, commands, period, bulk=False):
+        self.name = name
+        self.commands = list(commands)
+        self.period = period
+        self.bulk = bulk
+        self.deadline = 0.0
+        self.runs = 0
+        self.missed = 0
+        self.last_run = None
+
+    def current_period(self):
+        if callable(self.period):
+            return self.period()
+        return self.period
+
+
+class PollScheduler:
+    """
+    Deadline-ordered queue of PollGroups.
+
+    The poller asks for the groups that are due, polls them, then hands each
+    back with done(); the group is requeued at its next deadline. Starting a
+    group more than one period late counts the skipped slots as missed
+    deadlines instead of bunching the catch-up polls together.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+        self.groups = {}
+        # poll-once groups that already ran, so a new plan doesn't repeat them
+        self.completed = {}
+
+    def add(self, group, start=None):
+        group.deadline = self.clock() if start is None else start
+        self.groups[group.name] = group
+        heapq.heappush(self._heap, (group.deadline, next(self._seq), group))
+
+    def __len__(self):
+        return len(self._heap)
+
+    def next_due(self):
+        """
+        Seconds until the earliest deadline (0 if overdue, None if idle).
+        """
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - self.clock())
+
+    def pop_due(self):
+        """
+        Remove and return every group whose deadline has passed, earliest first.
+        """
+        now = self.clock()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def done(self, group, started):
+        """
+        Record a finished poll of `group` that began at `started` and requeue it.
+        Returns the number of deadlines it missed.
+        """
+        group.runs += 1
+        group.last_run = started
+        period = group.current_period()
+        if not period:
+            del self.groups[group.name]
+            self.completed[group.name] = group
+            return 0
+
+        missed = int((started - group.deadline) // period)
+        if missed > 0:
+            group.missed += missed
+            print(f"[SCHEDULER] {group.name} started {started - group.deadline:.1f}s late, "
+                  f"missed {missed} deadline(s)")
+        group.deadline += period * (max(missed, 0) + 1)
+        heapq.heappush(self._heap, (group.deadline, next(self._seq), group))
+        return max(missed, 0)
+
+    def retry(self, group, delay):
+        """
+        Requeue a group whose poll failed, `delay` seconds from now, without
+        moving its deadline (so the lateness still shows up as missed slots).
+        """
+        heapq.heappush(self._heap, (self.clock() + delay, next(self._seq), group))
+
+    def apply(self, groups):
+        """
+        Switch to a new set of groups, matched to the current ones by name.
+        Kept groups carry over their deadline and counters (pulled in if the
+        new period makes them due sooner), new ones are due now and removed
+        ones are dropped; a poll-once group that already ran is not repeated
+        unless its commands changed. Returns (added, changed, removed) names.
+        """
+        now = self.clock()
+        new = {}
+        added, changed = [], []
+        for group in groups:
+            done = self.completed.get(group.name)
+            if done is not None and done.commands == group.commands:
+                continue
+            old = self.groups.get(group.name)
+            if old is None:
+                group.deadline = now
+                added.append(group.name)
+            else:
+                if (old.commands != group.commands
+                        or old.current_period() != group.current_period()
+                        or old.bulk != group.bulk):
+                    changed.append(group.name)
+                group.deadline = old.deadline
+                group.runs, group.missed, group.last_run = old.runs, old.missed, old.last_run
+                period = group.current_period()
+                if period and group.last_run is not None:
+                    group.deadline = min(group.deadline, group.last_run + period)
+            new[group.name] = group
+        removed = [name for name in self.groups if name not in new]
+
+        self.groups = new
+        self._heap = [(g.deadline, next(self._seq), g) for g in new.values()]
+        heapq.heapify(self._heap)
+        return added, changed, removed
+
+
+class PollPlan:
+    """
+    The PollGroups a poller should be running, replaced atomically by
+    whatever changes the configuration (the variables page, the machine-info
+    form). The poller sleeps in wait(), which returns early on a change, and
+    applies the new groups at its next scheduling point.
+    """
+
+    def __init__(self, groups=()):
+        self.groups = tuple(groups)
+        self.version = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+
+    def replace(self, groups):
+        with self._lock:
+            self.groups = tuple(groups)
+            self.version += 1
+        self._changed.set()
+
+    def snapshot(self):
+        """
+        (version, groups) of the current plan; clears the change flag.
+        """
+        with self._lock:
+            self._changed.clear()
+            return self.version, self.groups
+
+    def wait(self, timeout):
+        """
+        Sleep up to `timeout` seconds; True if the plan changed meanwhile.
+        """
+        return self._changed.wait(timeout)
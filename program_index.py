@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from config_store import atomic_write_json
+
+PROGRAM_RE = re.compile(rb'^\s*O(\d+)\s*(.*)', re.IGNORECASE)
+
+
+def scan_program(filepath):
+    """
+    Read a program once and return its index entry: O-number, program name,
+    size, mtime, line count and SHA-1 of the contents.
+    """
+    st = os.stat(filepath)
+    digest = hashlib.sha1()
+    lines = 0
+    number = name = None
+    with open(filepath, 'rb') as f:
+        for line in f:
+            digest.update(line)
+            lines += 1
+            if number is None:
+                m = PROGRAM_RE.match(line)
+                if m:
+                    number = m.group(1).decode('ascii')
+                    name = m.group(2).decode('ascii', errors='ignore').strip()
+    if number is None:
+        program = os.path.splitext(os.path.basename(filepath))[0]
+    else:
+        program = f"{number} {name}" if name else number
+    return {
+        "filename": os.path.basename(filepath),
+        "o_number": number,
+        "name": name or "",
+        "program": program,
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "lines": lines,
+        "sha1": digest.hexdigest()
+    }
+
+
+class ProgramIndex:
+    """
+    Persistent index of the upload folder, kept in `<folder>/.program_index.json`
+    and re-read when another process sharing the folder saves it.
+
+    Uploads and deletes update single entries; a background rescan (at most
+    every `rescan_interval` seconds, triggered by reads) only re-reads files
+    whose size or mtime changed. Page views read the in-memory copy.
+    """
+
+    def __init__(self, folder, rescan_interval=30):
+        self.folder = folder
+        self.path = os.path.join(folder, ".program_index.json")
+        self.rescan_interval = rescan_interval
+        self.entries = {}
+        self._sorted = None
+        self._lock = threading.Lock()
+        self._last_scan = 0.0
+        self._scanning = False
+        self._signature = None
+        self._load()
+        self.rescan()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self):
+        signature = self._stat()
+        if signature is None:
+            return
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[INDEX] Rebuilding unreadable {self.path}: {e}")
+        self._sorted = None
+        self._signature = signature
+
+    def _refresh(self):
+        """
+        Re-read the index if another process sharing the folder (a web
+        worker or the gateway service) saved it since we last did.
+        """
+        if self._stat() != self._signature:
+            with self._lock:
+                if self._stat() != self._signature:
+                    self._load()
+
+    def _save(self):
+        # unique temp file per writer, so processes sharing the folder
+        # never rename each other's half-written copy
+        atomic_write_json(self.path, self.entries)
+        self._signature = self._stat()
+
+    def _changed(self):
+        self._sorted = None
+        self._save()
+
+    def update(self, filename):
+        """
+        (Re)index one file, e.g. right after an upload.
+        """
+        entry = scan_program(os.path.join(self.folder, filename))
+        with self._lock:
+            self.entries[filename] = entry
+            self._changed()
+        return entry
+
+    def remove(self, filename):
+        with self._lock:
+            if self.entries.pop(filename, None) is not None:
+                self._changed()
+
+    def get(self, filename):
+        """
+        Entry for `filename`, indexing it first if it isn't known yet.
+        """
+        self._refresh()
+        entry = self.entries.get(filename)
+        if entry is None:
+            entry = self.update(filename)
+        return entry
+
+    def rescan(self):
+        """
+        Bring the index in line with the folder, re-reading only new or
+        modified files.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        seen = {}
+        with os.scandir(self.folder) as it:
+            for de in it:
+                if de.name.startswith(".") or not de.is_file():
+                    continue
+                seen[de.name] = de.stat()
+
+        with self._lock:
+            known = dict(self.entries)
+        fresh = {}
+        for fn, st in seen.items():
+            old = known.get(fn)
+            if old and old["size"] == st.st_size and old["mtime"] == st.st_mtime:
+                continue
+            try:
+                fresh[fn] = scan_program(os.path.join(self.folder, fn))
+            except OSError:
+                pass
+
+        with self._lock:
+            gone = [fn for fn in self.entries if fn not in seen]
+            for fn in gone:
+                del self.entries[fn]
+            self.entries.update(fresh)
+            if gone or fresh:
+                self._changed()
+        self._last_scan = time.monotonic()
+
+    def maybe_rescan(self):
+        """
+        Start a background rescan if the last one is older than rescan_interval.
+        """
+        if self._scanning or time.monotonic() - self._last_scan < self.rescan_interval:
+            return
+        self._scanning = True
+
+        def run():
+            try:
+                self.rescan()
+            except Exception as e:
+                print(f"[INDEX] Rescan failed: {e}")
+            finally:
+                self._scanning = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def query(self, search="", page=1, per_page=50):
+        """
+        One page of entries sorted by filename, optionally filtered by a
+        case-insensitive match on filename or program. Returns (entries, total).
+        """
+        self._refresh()
+        self.maybe_rescan()
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = [self.entries[fn] for fn in sorted(self.entries)]
+            rows = self._sorted
+        if search:
+            needle = search.lower()
+            rows = [e for e in rows
+                    if needle in e["filename"].lower() or needle in e["program"].lower()]
+        start = (max(page, 1) - 1) * per_page
+        return rows[start:start + per_page], len(rows)
@@ -0,0 +1,109 @@
+import re
+
+# "?Q104", "Q104", "?Q600 3026" and our "?3026" macro reads
+COMMAND_RE = re.compile(r'^\??\s*(Q\d+)?\s*(\d+)?', re.IGNORECASE)
+
+
+def _fields(response):
+    return [p.strip() for p in response.split(",")]
+
+def _to_int(text):
+    return int(float(text))
+
+def parse_duration(text):
+    """
+    "00027:50:59" (hours:minutes:seconds, any number of hour digits) -> seconds.
+    """
+    total = 0.0
+    for part in text.strip().split(":"):
+        total = total * 60 + float(part)
+    return total
+
+
+def text(name):
+    def parse(parts):
+        return {name: ", ".join(parts[1:]) if len(parts) > 1 else parts[0]}
+    return parse
+
+def enum(name):
+    def parse(parts):
+        return {name: parts[-1].upper()}
+    return parse
+
+def integer(name):
+    def parse(parts):
+        return {name: _to_int(parts[-1])}
+    return parse
+
+def duration(name):
+    def parse(parts):
+        return {name: parse_duration(parts[-1])}
+    return parse
+
+def parse_q500(parts):
+    """
+    "PROGRAM, O00110, IDLE, PARTS, 4375" or "STATUS, BUSY".
+    """
+    if parts[0].upper() == "STATUS":
+        return {"status": parts[-1].upper()}
+    fields = {}
+    if len(parts) > 1:
+        fields["program"] = parts[1]
+    if len(parts) > 2:
+        fields["status"] = parts[2].upper()
+    if len(parts) > 4 and parts[3].upper() == "PARTS":
+        fields["parts"] = _to_int(parts[4])
+    return fields
+
+def parse_macro(parts):
+    return {"value": float(parts[-1])}
+
+
+PARSERS = {
+    "Q100": text("serial_number"),
+    "Q101": text("software_version"),
+    "Q102": text("model"),
+    "Q104": enum("mode"),
+    "Q200": integer("tool_changes"),
+    "Q201": integer("tool"),
+    "Q300": duration("power_on_time"),
+    "Q301": duration("motion_time"),
+    "Q303": duration("last_cycle_time"),
+    "Q304": duration("previous_cycle_time"),
+    "Q402": integer("m30_counter_1"),
+    "Q403": integer("m30_counter_2"),
+    "Q500": parse_q500,
+    "Q600": parse_macro,
+}
+
+
+def parser_for(command):
+    m = COMMAND_RE.match(command.strip())
+    code = (m.group(1) or "").upper()
+    if not code and m.group(2):
+        code = "Q600"
+    return PARSERS.get(code)
+
+def parse_response(command, response):
+    """
+    Typed fields of one Q-command reply, e.g. {"mode": "MEM"},
+    {"power_on_time": 100259.0} or {"value": 1.0} for a macro variable.
+    Numbers are int/float (durations in seconds), enums/text are str.
+    Returns {} for empty or unrecognised replies.
+    """
+    parser = parser_for(command)
+    if parser is None or not response:
+        return {}
+    try:
+        return parser(_fields(response))
+    except (ValueError, IndexError):
+        return {}
+
+def numeric_value(fields):
+    """
+    The first numeric field of a parsed reply, or None.
+    """
+    for value in fields.values():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+    return None
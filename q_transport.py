@@ -0,0 +1,268 @@
+import re
+import threading
+import time
+from collections import deque
+
+from metrics import REGISTRY
+
+STX = b"\x02"
+ETB = b"\x17"
+
+# trailing variable number of a macro read ("?Q600 1601", "?1601")
+VAR_RE = re.compile(r'(\d+)\s*$')
+COMMAND_RE = re.compile(r'^\??\s*(Q\d+)?', re.IGNORECASE)
+
+# the label each command's reply starts with ("MODE, MEM" answers Q104);
+# a reply carrying another command's label is a late answer to that one
+REPLY_LABELS = {
+    "SERIAL NUMBER":    "Q100",
+    "SOFTWARE VERSION": "Q101",
+    "MODEL":            "Q102",
+    "MODE":             "Q104",
+    "TOOL CHANGES":     "Q200",
+    "USING TOOL":       "Q201",
+    "P.O. TIME":        "Q300",
+    "C.S. TIME":        "Q301",
+    "LAST CYCLE":       "Q303",
+    "PREV CYCLE":       "Q304",
+    "M30 #1":           "Q402",
+    "M30 #2":           "Q403",
+    "PROGRAM":          "Q500",
+    "STATUS":           "Q500",
+}
+
+COMMAND_SECONDS = REGISTRY.histogram(
+    "cnc_serial_command_seconds", "Q-command reply time", ("port", "command"))
+COMMAND_TIMEOUTS = REGISTRY.counter(
+    "cnc_serial_command_timeouts_total", "Q-commands without a complete reply", ("port", "command"))
+
+
+def command_label(command):
+    """
+    "Q104" for "?Q104", "Q600" for any macro read; keeps metric labels few.
+    """
+    return (COMMAND_RE.match(command.strip()).group(1) or "Q600").upper()
+
+
+class QTransport:
+    """
+    Sends one Q-command and reads until the controller's ETB end-of-response
+    marker instead of sleeping a fixed interval.
+
+    The per-command timeout is derived from a running (EWMA) estimate of how
+    long this port takes to answer, so a fast machine is polled at line rate
+    and a slow or busy one still gets enough time to reply.
+    """
+
+    def __init__(self, initial_latency=0.3, min_timeout=0.1, max_timeout=2.0,
+                 margin=3.0, alpha=0.2, window=4, max_window=8):
+        self.latency = initial_latency
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.margin = margin
+        self.alpha = alpha
+        self.last_elapsed = None
+        self.timeouts = 0
+        # commands kept in flight by query_many(); halved whenever the
+        # controller falls behind, regrown after a clean batch
+        self.window = window
+        self.max_window = max_window
+        self._lock = threading.Lock()
+
+    def timeout(self):
+        """
+        Current per-command timeout in seconds.
+        """
+        t = self.latency * self.margin + 0.05
+        return max(self.min_timeout, min(self.max_timeout, t))
+
+    def _observe(self, elapsed):
+        with self._lock:
+            self.latency += self.alpha * (elapsed - self.latency)
+            self.last_elapsed = elapsed
+
+    def _missed(self):
+        # back off so the next command gets more time, capped by max_timeout
+        with self._lock:
+            self.timeouts += 1
+            self.latency = min(self.latency * 2, self.max_timeout)
+
+    def query(self, ser, command, timeout=None):
+        """
+        Write `command` to `ser` and return the decoded reply (framing removed),
+        or whatever partial text arrived before the timeout.
+
+        Replies that answer a different command (an earlier one that missed
+        its timeout) are skipped while there is time left; if the reply
+        doesn't come, or isn't ours, the line is drained until it goes quiet
+        so the next command starts in step.
+        """
+        if not command.endswith('\r'):
+            command += '\r'
+        timeout = timeout or self.timeout()
+
+        # drop any stale bytes (prompt, late reply) so they aren't read as ours
+        ser.reset_input_buffer()
+        # read_until() honours ser.timeout as its overall deadline; only touch
+        # it when it changes, since setting it reconfigures the port
+        rounded = round(timeout, 2)
+        if ser.timeout != rounded:
+            ser.timeout = rounded
+
+        start = time.monotonic()
+        ser.write(command.encode('ascii'))
+        raw = ser.read_until(ETB)
+        while (raw.endswith(ETB) and not _answers(decode_response(raw), command)
+               and time.monotonic() - start < timeout):
+            raw = ser.read_until(ETB)
+        elapsed = time.monotonic() - start
+
+        label = command_label(command)
+        reply = decode_response(raw)
+        if raw.endswith(ETB) and _answers(reply, command):
+            self._observe(elapsed)
+            COMMAND_SECONDS.observe(elapsed, port=ser.port, command=label)
+            return reply
+        self._missed()
+        COMMAND_TIMEOUTS.inc(port=ser.port, command=label)
+        _drain(ser, rounded)
+        return "" if raw.endswith(ETB) else reply
+
+    def query_many(self, ser, commands, timeout=None, preempt=None):
+        """
+        Pipelined version of query() for a batch of commands, e.g. a Q600
+        tool-table range. Up to `window` commands are written back-to-back
+        before their replies are read; replies that carry a variable number
+        are matched to their command by it (and dropped if that command
+        isn't in flight: a late answer to an earlier attempt), others are
+        taken in send order.
+
+        If a reply doesn't arrive in time the controller has fallen behind:
+        the line is drained until it goes quiet, whatever was in flight is
+        re-sent, and the rest of the batch runs stop-and-wait. Returns the
+        replies in command order ("" or partial text for commands that never
+        answered).
+
+        With `preempt` (the port's SerialConnection) the batch stops sending
+        when a more urgent session waits, drains its replies and hands the
+        port over before carrying on.
+        """
+        replies = [""] * len(commands)
+        todo = deque(range(len(commands)))
+        window = self.window
+        clean = True
+
+        def prepare(ser):
+            ser.reset_input_buffer()
+            rounded = round(timeout or self.timeout(), 2)
+            if ser.timeout != rounded:
+                ser.timeout = rounded
+        prepare(ser)
+
+        in_flight = deque()
+        last_reply = time.monotonic()
+        while todo or in_flight:
+            yielding = preempt is not None and todo and preempt.contended()
+            if yielding and not in_flight:
+                ser = preempt.checkpoint(ser)
+                prepare(ser)
+                last_reply = time.monotonic()
+                continue
+            while todo and len(in_flight) < window and not yielding:
+                i = todo.popleft()
+                command = commands[i]
+                if not command.endswith('\r'):
+                    command += '\r'
+                ser.write(command.encode('ascii'))
+                in_flight.append((i, time.monotonic()))
+
+            raw = ser.read_until(ETB)
+            now = time.monotonic()
+            if not raw.endswith(ETB):
+                self._missed()
+                clean = False
+                oldest, _ = in_flight.popleft()
+                COMMAND_TIMEOUTS.inc(port=ser.port, command=command_label(commands[oldest]))
+                replies[oldest] = decode_response(raw)
+                # late replies would be mismatched; let them arrive and
+                # throw them away before re-sending
+                _drain(ser, round(timeout or self.timeout(), 2))
+                todo.extendleft(reversed([i for i, _ in in_flight]))
+                in_flight.clear()
+                window = 1
+                last_reply = now
+                continue
+
+            reply = decode_response(raw)
+            pos = _match(reply, [commands[i] for i, _ in in_flight])
+            if pos is None:
+                continue
+            i, sent = in_flight[pos]
+            del in_flight[pos]
+            replies[i] = reply
+            # time this reply spent on the wire, not queued behind others
+            self._observe(now - max(sent, last_reply))
+            COMMAND_SECONDS.observe(now - max(sent, last_reply), port=ser.port,
+                                    command=command_label(commands[i]))
+            last_reply = now
+
+        with self._lock:
+            if clean:
+                self.window = min(self.max_window, self.window * 2)
+            else:
+                self.window = max(1, self.window // 2)
+        return replies
+
+
+def _match(reply, commands):
+    """
+    Index in `commands` of the one `reply` answers: "MACRO, 1601, 4.0" style
+    replies by variable number (None if no command reads that variable),
+    anything else is taken as the oldest.
+    """
+    parts = [p.strip() for p in reply.split(",")]
+    if len(parts) >= 3 and parts[1].isdigit():
+        for pos, command in enumerate(commands):
+            m = VAR_RE.search(command.strip())
+            if m and int(m.group(1)) == int(parts[1]):
+                return pos
+        return None
+    return 0
+
+def _answers(reply, command):
+    """
+    False if `reply` is labelled as the answer to another command than
+    `command`: a macro read of another variable, or another Q-code's label.
+    Unlabelled replies ("UNKNOWN COMMAND", ...) are taken as ours.
+    """
+    parts = [p.strip() for p in reply.split(",")]
+    code = command_label(command)
+    if len(parts) >= 3 and parts[1].isdigit():
+        m = VAR_RE.search(command.strip())
+        return code == "Q600" and m is not None and int(m.group(1)) == int(parts[1])
+    owner = REPLY_LABELS.get(parts[0].upper())
+    return owner is None or owner == code
+
+def _drain(ser, quiet, max_rounds=20):
+    """
+    Discard input until nothing has arrived for `quiet` seconds (at most
+    `max_rounds` reads), then restore the port's timeout.
+    """
+    ser.reset_input_buffer()
+    saved = ser.timeout
+    ser.timeout = quiet
+    try:
+        for _ in range(max_rounds):
+            if not ser.read(4096):
+                break
+    finally:
+        ser.timeout = saved
+
+
+def decode_response(raw):
+    """
+    Strip STX/ETB framing and surrounding whitespace from a raw reply.
+    """
+    if STX in raw:
+        raw = raw.rsplit(STX, 1)[1]
+    return raw.replace(ETB, b"").decode('ascii', errors='ignore').strip()
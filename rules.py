@@ -0,0 +1,234 @@
+import operator
+import threading
+from collections import deque
+
+OPS = {
+    ">":  operator.gt,
+    ">=": operator.ge,
+    "<":  operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def _number(rule_id, name, value):
+    # specs come from JSON edited by hand or posted to /api/rules: "10"
+    # would otherwise only fail when compared with a reading
+    if isinstance(value, bool):
+        raise ValueError(f"Rule {rule_id}: {name} must be a number, not {value!r}")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Rule {rule_id}: {name} must be a number, not {value!r}") from None
+
+
+class Rule:
+    """
+    One compiled condition on live readings, `tag op limit`, where limit is
+    a constant `value` or `factor` x another tag's latest value (a zero
+    there means "no limit set" and never matches). With `rate` the left
+    side is the tag's change per `per` seconds instead of its value.
+
+    The condition has to hold for `for_s` seconds before the alert is
+    raised, and stay false for `clear_s` seconds before it clears.
+    """
+
+    def __init__(self, id, tag, op, value=None, other=None, factor=1.0, rate=False,
+                 per=60.0, for_s=0.0, clear_s=0.0, severity="warning", message=""):
+        if op not in OPS:
+            raise ValueError(f"Rule {id}: unknown operator {op!r}")
+        if value is None and other is None:
+            raise ValueError(f"Rule {id}: needs a value or another tag to compare with")
+        if not isinstance(tag, str) or not (other is None or isinstance(other, str)):
+            raise ValueError(f"Rule {id}: tags must be strings")
+        self.id = id
+        self.tag = tag
+        self.op = op
+        self.compare = OPS[op]
+        self.value = None if value is None else _number(id, "value", value)
+        self.other = other
+        self.factor = _number(id, "factor", factor)
+        self.rate = rate
+        self.per = _number(id, "per", per)
+        self.for_s = _number(id, "for", for_s)
+        self.clear_s = _number(id, "clear_for", clear_s)
+        self.severity = severity
+        self.message = message
+        self.tags = (tag, other) if other else (tag,)
+        self.active = False
+        self.since = None
+
+    def evaluate(self, engine):
+        """
+        (matched, left, limit), or None while inputs are missing.
+        """
+        if self.rate:
+            left = engine.rates.get(self.tag)
+            if left is not None:
+                left *= self.per
+        else:
+            left = engine.values.get(self.tag)
+        if left is None:
+            return None
+        if self.other is None:
+            limit = self.value
+        else:
+            other = engine.values.get(self.other)
+            if other is None or other == 0:
+                return None
+            limit = other * self.factor
+        return self.compare(left, limit), left, limit
+
+    def step(self, now, matched):
+        """
+        Debounced transition: "raised", "cleared" or None.
+        """
+        if matched == self.active:
+            self.since = None
+            return None
+        if self.since is None:
+            self.since = now
+        if now - self.since >= (self.for_s if matched else self.clear_s):
+            self.active = matched
+            self.since = None
+            return "raised" if matched else "cleared"
+        return None
+
+
+def compile_rules(specs, ranges=None):
+    """
+    Rule objects for a list of JSON rule specs.
+
+    A spec with "range" / "other_range" (Q600 range labels, looked up in
+    `ranges` = {label: [tag, ...]}) expands into one rule per position,
+    e.g. each tool's life counter against its own life limit.
+    """
+    ranges = ranges or {}
+    rules = []
+    for spec in specs:
+        spec = dict(spec)
+        rule_id = spec.pop("id")
+        options = {
+            "op":       spec.get("op", ">="),
+            "value":    spec.get("value"),
+            "factor":   spec.get("factor", 1.0),
+            "rate":     spec.get("rate", False),
+            "per":      spec.get("per", 60.0),
+            "for_s":    spec.get("for", 0.0),
+            "clear_s":  spec.get("clear_for", 0.0),
+            "severity": spec.get("severity", "warning"),
+            "message":  spec.get("message", ""),
+        }
+        if "range" in spec:
+            tags = ranges.get(spec["range"], [])
+            others = ranges.get(spec["other_range"], []) if "other_range" in spec else [None] * len(tags)
+            for tag, other in zip(tags, others):
+                rules.append(Rule(f"{rule_id} {tag}", tag, other=other, **options))
+        else:
+            rules.append(Rule(rule_id, spec["tag"], other=spec.get("other"), **options))
+    return rules
+
+
+class RuleEngine:
+    """
+    Evaluates rules inline on each reading.
+
+    Rules are indexed by every tag they read, so a reading only re-checks
+    the few rules that depend on it, however many rules there are. Raised
+    and cleared alerts go to each `on_alert(alert)` callback and are kept
+    as `active` plus the `recent` history.
+    """
+
+    def __init__(self, specs=(), ranges=None, keep=200):
+        self.values = {}
+        self.rates = {}
+        self._times = {}
+        self.active = {}
+        self.recent = deque(maxlen=keep)
+        self.on_alert = []
+        self.rules = []
+        self._lock = threading.Lock()
+        self.load(specs, ranges)
+
+    def load(self, specs, ranges=None):
+        """
+        Replace the rule set. Rules that keep their id keep their alert
+        state, so a reload neither re-raises active alerts nor loses their
+        clearing; alerts of rules that no longer exist are dropped.
+        """
+        rules = compile_rules(specs, ranges)
+        index = {}
+        for rule in rules:
+            for tag in rule.tags:
+                index.setdefault(tag, []).append(rule)
+        with self._lock:
+            previous = {rule.id: rule for rule in self.rules}
+            for rule in rules:
+                old = previous.get(rule.id)
+                if old is not None:
+                    rule.active, rule.since = old.active, old.since
+            self.rules = rules
+            self.index = index
+            ids = {rule.id for rule in rules}
+            self.active = {k: v for k, v in self.active.items() if k in ids}
+
+    def feed(self, tag, value, ts):
+        """
+        Record one numeric reading (epoch seconds `ts`) and evaluate the
+        rules that depend on `tag`. Returns the alerts it raised or cleared.
+        """
+        alerts = []
+        with self._lock:
+            previous, previous_ts = self.values.get(tag), self._times.get(tag)
+            if previous is not None and ts > previous_ts:
+                self.rates[tag] = (value - previous) / (ts - previous_ts)
+            self.values[tag] = value
+            self._times[tag] = ts
+
+            for rule in self.index.get(tag, ()):
+                # one broken rule must not stop the others, or the poll
+                try:
+                    result = rule.evaluate(self)
+                    if result is None:
+                        continue
+                    matched, left, limit = result
+                    transition = rule.step(ts, matched)
+                except Exception as e:
+                    print(f"[RULES] Rule {rule.id} failed: {e}")
+                    continue
+                if transition is None:
+                    continue
+                alert = {
+                    "rule":     rule.id,
+                    "tag":      rule.tag,
+                    "state":    transition,
+                    "severity": rule.severity,
+                    "value":    left,
+                    "limit":    limit,
+                    "op":       rule.op,
+                    "message":  rule.message or f"{rule.tag} {rule.op} {limit:g}",
+                    "time":     ts,
+                }
+                if transition == "raised":
+                    self.active[rule.id] = alert
+                else:
+                    self.active.pop(rule.id, None)
+                self.recent.append(alert)
+                alerts.append(alert)
+
+        for alert in alerts:
+            for callback in self.on_alert:
+                try:
+                    callback(alert)
+                except Exception as e:
+                    print(f"[RULES] Alert handler failed: {e}")
+        return alerts
+
+    def summary(self):
+        with self._lock:
+            return {
+                "rules":  len(self.rules),
+                "active": sorted(self.active.values(), key=lambda a: a["time"], reverse=True),
+                "recent": list(reversed(self.recent)),
+            }
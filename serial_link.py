@@ -0,0 +1,362 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import serial
+
+from config_store import STORE
+from metrics import REGISTRY
+
+PARITY_MAP = {
+    "N": serial.PARITY_NONE,
+    "E": serial.PARITY_EVEN,
+    "O": serial.PARITY_ODD,
+    "None": serial.PARITY_NONE,
+    "Even": serial.PARITY_EVEN,
+    "Odd": serial.PARITY_ODD,
+    None: serial.PARITY_NONE
+}
+
+PORT_KEYS = ("port", "baudrate", "bytesize", "parity", "stopbits")
+
+LOCK_WAIT = REGISTRY.histogram(
+    "cnc_serial_lock_wait_seconds", "Time spent waiting for the serial port lock", ("port", "owner"))
+LOCK_HOLD = REGISTRY.histogram(
+    "cnc_serial_lock_hold_seconds", "Time the serial port lock was held", ("port", "owner"))
+QUEUE_DEPTH = REGISTRY.gauge(
+    "cnc_serial_queue_depth", "Sessions waiting for the serial port", ("port", "priority"))
+OLDEST_WAIT = REGISTRY.gauge(
+    "cnc_serial_oldest_wait_seconds", "How long the longest waiting session has waited", ("port",))
+HANDOVERS = REGISTRY.counter(
+    "cnc_serial_handovers_total", "Times a session gave the port up between commands", ("port", "owner"))
+
+# who gets the port first when several want it; lower wins
+PRIORITY_SEND = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_POLL = 2
+PRIORITY_NAMES = {PRIORITY_SEND: "send", PRIORITY_INTERACTIVE: "interactive", PRIORITY_POLL: "poll"}
+OWNER_PRIORITY = {"send": PRIORITY_SEND, "info": PRIORITY_INTERACTIVE,
+                  "query": PRIORITY_INTERACTIVE, "monitor": PRIORITY_POLL}
+
+
+class PortBusy(serial.SerialException):
+    """
+    A session wasn't granted the port before its deadline.
+    """
+
+
+class PortArbiter:
+    """
+    Hands a port to one session at a time: the waiting session with the
+    lowest priority number first, in arrival order within a priority.
+    Re-entrant for the thread that holds it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiting = []      # heap of (priority, seq, owner, asked)
+        self._seq = itertools.count()
+        self.holder = None      # (thread id, priority, owner)
+        self._depth = 0
+        self.granted = 0
+
+    def acquire(self, priority, owner, timeout=None):
+        """
+        Wait for the port; with `timeout` (seconds) give up, leave the
+        queue and return False once it passes.
+        """
+        me = threading.get_ident()
+        with self._cond:
+            if self.holder is not None and self.holder[0] == me:
+                self._depth += 1
+                return True
+            ticket = (priority, next(self._seq), owner, time.monotonic())
+            deadline = None if timeout is None else ticket[3] + timeout
+            heapq.heappush(self._waiting, ticket)
+            while self.holder is not None or self._waiting[0] is not ticket:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    # the next waiter may be first now
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiting)
+            self.holder = (me, priority, owner)
+            self._depth = 1
+            self.granted += 1
+            # wakes a handover() waiting for its turn to be taken
+            self._cond.notify_all()
+            return True
+
+    def release(self):
+        with self._cond:
+            self._depth -= 1
+            if self._depth == 0:
+                self.holder = None
+                self._cond.notify_all()
+
+    def contended(self, lend=False):
+        """
+        True if the holder should hand over: a more urgent session is
+        waiting, or with `lend` any session at all.
+        """
+        with self._cond:
+            if not self._waiting or self.holder is None:
+                return False
+            return lend or self._waiting[0][0] < self.holder[1]
+
+    def handover(self):
+        """
+        Let the first waiter have one turn, then queue up again at the same
+        priority. Returns once the port is ours again.
+        """
+        with self._cond:
+            _, priority, owner = self.holder
+            depth, granted = self._depth, self.granted
+            self.holder = None
+            self._cond.notify_all()
+            # queue again only after someone else got the port, or a send
+            # lending it to pollers would just win it straight back
+            while self.granted == granted and self._waiting:
+                self._cond.wait()
+        self.acquire(priority, owner)
+        with self._cond:
+            self._depth = depth
+
+    def waiting(self):
+        """
+        ({priority: sessions waiting}, seconds the oldest has waited).
+        """
+        with self._cond:
+            depth = {}
+            for priority, _, _, _ in self._waiting:
+                depth[priority] = depth.get(priority, 0) + 1
+            oldest = min((asked for _, _, _, asked in self._waiting), default=None)
+        return depth, (time.monotonic() - oldest if oldest is not None else 0.0)
+
+
+class SerialConnection:
+    """
+    One long-lived serial port shared by the monitor thread, machine-info
+    refresh, operator queries and file sends.
+
+    Sessions are granted by priority (drip-feed, then interactive, then
+    polling) rather than first come, and a holder hands the port over at
+    checkpoint() between commands when something more urgent is waiting,
+    so an operator never queues behind a whole poll pass.
+
+    The port is opened lazily and kept open between uses. A failed open or
+    I/O error closes it and schedules a reconnect with exponential backoff;
+    changed settings (via reconfigure() or an edited config file) are applied
+    by reopening at the next session.
+    """
+
+    def __init__(self, config, config_path=None, min_backoff=0.5, max_backoff=30.0):
+        self.config = dict(config)
+        self.config_path = config_path
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.RLock()
+        self.arbiter = PortArbiter()
+        self.ser = None
+        self.backoff = min_backoff
+        self.next_attempt = 0.0
+        self.last_error = None
+        self.reconnects = 0
+        self._pending_config = None
+        if config_path:
+            STORE.subscribe(config_path, self._config_changed)
+
+    def _config_changed(self, path, config):
+        # applied by the next session(), so a running send isn't waited on
+        self._pending_config = config
+
+    def _apply_pending(self):
+        config, self._pending_config = self._pending_config, None
+        if config is not None:
+            self.reconfigure(config)
+
+    def reconfigure(self, config):
+        """
+        Apply new port settings; the port is reopened only if they changed.
+        """
+        with self.lock:
+            changed = any(config.get(k) != self.config.get(k) for k in PORT_KEYS)
+            self.config.update(config)
+            if changed:
+                print(f"[SERIAL] Settings changed, reopening {self.config['port']}")
+                self.close()
+                self.next_attempt = 0.0
+                self.backoff = self.min_backoff
+
+    def healthy(self):
+        """
+        Cheap liveness check: port object open and (for device paths) still present.
+        """
+        if self.ser is None or not self.ser.is_open:
+            return False
+        port = self.config["port"]
+        if port.startswith("/dev/") and not os.path.exists(port):
+            return False
+        return True
+
+    def retry_in(self):
+        """
+        Seconds until the next reconnect attempt is allowed (0 if connected).
+        """
+        if self.healthy():
+            return 0.0
+        return max(0.0, self.next_attempt - time.monotonic())
+
+    def _open(self):
+        now = time.monotonic()
+        if now < self.next_attempt:
+            raise serial.SerialException(
+                f"{self.config['port']} unavailable ({self.last_error}); "
+                f"retrying in {self.next_attempt - now:.1f}s")
+        try:
+            self.ser = serial.Serial(
+                port=self.config["port"],
+                baudrate=self.config["baudrate"],
+                bytesize=self.config["bytesize"],
+                parity=PARITY_MAP.get(self.config.get("parity"), serial.PARITY_NONE),
+                stopbits=self.config["stopbits"],
+                timeout=1,
+                xonxoff=True
+            )
+        except (serial.SerialException, OSError, ValueError) as e:
+            self._failed(e)
+            raise
+        if self.reconnects or self.last_error:
+            print(f"[SERIAL] Reconnected to {self.config['port']}")
+        self.reconnects += 1
+        self.backoff = self.min_backoff
+        self.last_error = None
+
+    def _failed(self, error):
+        self.close()
+        self.last_error = error
+        self.next_attempt = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def close(self):
+        with self.lock:
+            if self.ser is not None:
+                try:
+                    self.ser.close()
+                except Exception:
+                    pass
+                self.ser = None
+
+    def _ready(self):
+        with self.lock:
+            self._apply_pending()
+            if not self.healthy():
+                self.close()
+                self._open()
+            return self.ser
+
+    @contextmanager
+    def session(self, owner="other", priority=None, timeout=None):
+        """
+        Hold the port exclusively and yield an open serial.Serial.
+
+        `priority` defaults by `owner` ("send", "info"/"query", "monitor").
+        With `timeout`, raises PortBusy if the port isn't granted within
+        that many seconds (e.g. during a send). Serial/OS errors raised
+        inside the block mark the port broken so the next session
+        reconnects. Wait and hold times are recorded per owner.
+        """
+        if priority is None:
+            priority = OWNER_PRIORITY.get(owner, PRIORITY_INTERACTIVE)
+        port = self.config["port"]
+        asked = time.monotonic()
+        if not self.arbiter.acquire(priority, owner, timeout):
+            LOCK_WAIT.observe(time.monotonic() - asked, port=port, owner=owner)
+            holder = self.arbiter.holder
+            raise PortBusy(f"{port} is busy ({holder[2] if holder else 'in use'}); "
+                           f"gave up after {timeout:g}s")
+        acquired = time.monotonic()
+        LOCK_WAIT.observe(acquired - asked, port=port, owner=owner)
+        try:
+            # opening handles its own failures (and refusals during backoff)
+            ser = self._ready()
+            try:
+                yield ser
+            except (serial.SerialException, OSError) as e:
+                # a reopen at checkpoint() already closed the port and
+                # scheduled its retry; only count errors on an open port
+                if self.ser is not None:
+                    self._failed(e)
+                raise
+        finally:
+            LOCK_HOLD.observe(time.monotonic() - acquired, port=port, owner=owner)
+            self.arbiter.release()
+
+    def contended(self, lend=False):
+        """
+        True if the session holder should hand the port over now.
+        """
+        return self.arbiter.contended(lend)
+
+    def checkpoint(self, ser, lend=False):
+        """
+        Called by the session holder between commands. If a more urgent
+        session is waiting (with `lend`, any session), let it have the port
+        and return once it is ours again. Returns the serial object to carry
+        on with, which is a new one if the other session had to reconnect.
+        """
+        if not self.contended(lend):
+            # a session we lent the port to may have reconnected it
+            return ser if self.ser is None else self.ser
+        owner = self.arbiter.holder[2]
+        HANDOVERS.inc(port=self.config["port"], owner=owner)
+        self.arbiter.handover()
+        return self._ready()
+
+    def stats(self):
+        holder = self.arbiter.holder
+        depth, oldest = self.arbiter.waiting()
+        return {
+            "port":        self.config["port"],
+            "holder":      holder[2] if holder else None,
+            "waiting":     {PRIORITY_NAMES.get(p, str(p)): n for p, n in sorted(depth.items())},
+            "oldest_wait": oldest,
+            "connected":   self.healthy(),
+        }
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+def get_connection(config, config_path=None, key=None):
+    """
+    Return the shared SerialConnection for `key` (a machine id; defaults to
+    config["port"]), creating it once. Keyed by owner rather than port, as
+    a connection follows its machine when the port setting changes.
+    """
+    key = key or config["port"]
+    with _connections_lock:
+        conn = _connections.get(key)
+        if conn is None:
+            conn = SerialConnection(config, config_path)
+            _connections[key] = conn
+        return conn
+
+def collect_queue_metrics():
+    QUEUE_DEPTH.clear()
+    OLDEST_WAIT.clear()
+    with _connections_lock:
+        connections = list(_connections.values())
+    for conn in connections:
+        depth, oldest = conn.arbiter.waiting()
+        for priority, name in PRIORITY_NAMES.items():
+            QUEUE_DEPTH.set(depth.get(priority, 0), port=conn.config["port"], priority=name)
+        OLDEST_WAIT.set(oldest, port=conn.config["port"])
+
+REGISTRY.add_collector(collect_queue_metrics)
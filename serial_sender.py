@@ -1,7 +1,74 @@
 
+import itertools
+import os
 import serial
+import threading
 import time
 
+from metrics import REGISTRY
+
+CHUNK_SIZE = 4096
+# keep at most this many bytes queued in the OS output buffer, so XON/XOFF
+# paces the transfer while we can still notice a cancel request
+HIGH_WATER = 16384
+
+SEND_BYTES = REGISTRY.counter(
+    "cnc_send_bytes_total", "Bytes drip-fed to the controller", ("port",))
+
+def stream_file(ser, filepath, progress=None, cancel=None, between_chunks=None):
+    """
+    Drip-feed `filepath` over an already-open port.
+
+    Lines are stripped, blank ones dropped and the rest sent CRLF-terminated
+    in CHUNK_SIZE writes; the controller's XON/XOFF does the pacing. Memory
+    use is constant regardless of file size. `progress(src_bytes, sent_bytes,
+    lines)` is called after every chunk; setting the `cancel` Event stops the
+    transfer and discards anything still queued. `between_chunks(ser)` may
+    lend the port out and returns the serial object to continue on.
+    Returns (src_bytes, sent_bytes, lines).
+    """
+    src = sent = lines = 0
+    chunk = bytearray()
+
+    def flush():
+        nonlocal sent, ser
+        if between_chunks is not None:
+            ser = between_chunks(ser)
+        while cancel is None or not cancel.is_set():
+            try:
+                if ser.out_waiting <= HIGH_WATER:
+                    break
+            except (AttributeError, NotImplementedError, serial.SerialException):
+                break
+            time.sleep(0.01)
+        if cancel is not None and cancel.is_set():
+            return
+        ser.write(chunk)
+        sent += len(chunk)
+        chunk.clear()
+        if progress:
+            progress(src, sent, lines)
+
+    with open(filepath, "rb") as file:
+        for line in file:
+            src += len(line)
+            cleaned = line.strip()
+            if cleaned:
+                chunk += cleaned + b"\r\n"
+                lines += 1
+                if len(chunk) >= CHUNK_SIZE:
+                    flush()
+            if cancel is not None and cancel.is_set():
+                break
+        else:
+            if chunk:
+                flush()
+    if cancel is not None and cancel.is_set():
+        ser.reset_output_buffer()
+    else:
+        ser.flush()
+    return src, sent, lines
+
 def send_file(filepath, port, baudrate, bytesize, parity, stopbits):
     parity_map = {
         "None": serial.PARITY_NONE,
@@ -18,9 +85,93 @@ def send_file(filepath, port, baudrate, bytesize, parity, stopbits):
         timeout=1,
         xonxoff=True
     ) as ser:
-        with open(filepath, "r") as file:
-            for line in file:
-                cleaned = line.strip()
-                if cleaned:
-                    ser.write((cleaned + "\r\n").encode("ascii"))
-                    time.sleep(0.05)
+        stream_file(ser, filepath)
+
+
+_job_ids = itertools.count(1)
+
+class SendJob:
+    """
+    A drip-feed running on its own thread over a shared SerialConnection,
+    with progress, throughput, ETA and cancellation.
+    """
+
+    def __init__(self, serial_conn, filepath, on_done=None):
+        self.id = next(_job_ids)
+        self.serial_conn = serial_conn
+        self.filepath = filepath
+        self.filename = os.path.basename(filepath)
+        self.total_bytes = os.path.getsize(filepath)
+        self.on_done = on_done
+        self.status = "queued"
+        self.error = None
+        self.src_bytes = self.sent_bytes = self.lines = 0
+        self.started = self.finished = None
+        self.cancel_event = threading.Event()
+        self._lent_at = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _progress(self, src, sent, lines):
+        SEND_BYTES.inc(sent - self.sent_bytes, port=self.serial_conn.config["port"])
+        self.src_bytes, self.sent_bytes, self.lines = src, sent, lines
+
+    def _between_chunks(self, ser):
+        # the send outranks everything, but with "poll_during_send" set
+        # (seconds) the port is lent for one status query that often. Off by
+        # default: a Haas loading a program reads every byte on the line as
+        # program text, so only enable it for controls that accept Q-commands
+        # mid-transfer (e.g. DNC with a separate command channel).
+        interval = self.serial_conn.config.get("poll_during_send", 0)
+        if not interval or time.monotonic() - self._lent_at < interval:
+            return ser
+        if not self.serial_conn.contended(lend=True):
+            return ser
+        ser.flush()
+        ser = self.serial_conn.checkpoint(ser, lend=True)
+        self._lent_at = time.monotonic()
+        return ser
+
+    def _run(self):
+        try:
+            with self.serial_conn.session(owner="send") as ser:
+                self.status = "running"
+                self.started = time.monotonic()
+                stream_file(ser, self.filepath, self._progress, self.cancel_event,
+                            self._between_chunks)
+            self.status = "cancelled" if self.cancel_event.is_set() else "done"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+        self.finished = time.monotonic()
+        if self.on_done:
+            self.on_done(self)
+
+    def to_dict(self):
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0.0
+        rate = self.sent_bytes / elapsed if elapsed > 0 else 0.0
+        src_rate = self.src_bytes / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.status == "running" and src_rate > 0:
+            eta = (self.total_bytes - self.src_bytes) / src_rate
+        return {
+            "id":            self.id,
+            "filename":      self.filename,
+            "status":        self.status,
+            "error":         self.error,
+            "total_bytes":   self.total_bytes,
+            "src_bytes":     self.src_bytes,
+            "sent_bytes":    self.sent_bytes,
+            "lines":         self.lines,
+            "percent":       100.0 * self.src_bytes / self.total_bytes if self.total_bytes else 100.0,
+            "elapsed":       elapsed,
+            "bytes_per_sec": rate,
+            "lines_per_sec": self.lines / elapsed if elapsed > 0 else 0.0,
+            "eta":           eta
+        }
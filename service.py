@@ -0,0 +1,54 @@
+"""
+The gateway's hardware service, for serving the web app from several
+worker processes:
+
+    python service.py
+    gunicorn -c gunicorn.conf.py 'app:create_app("web")'
+
+gunicorn.conf.py uses threaded workers: each open live page holds a
+request (its event stream) for as long as it is open, which would take a
+whole default sync worker.
+
+The service takes the leader lock, polls every machine, runs sends and
+forwards readings; the web workers hold no serial ports and read live
+data, job status and metrics from it over the local socket. A second
+service started with --standby waits on the lock and takes over when the
+first one exits.
+"""
+import argparse
+import signal
+import sys
+
+import app
+from gateway_service import LeaderLock, ServiceServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CNC gateway hardware service")
+    parser.add_argument("--standby", action="store_true",
+                        help="wait for the running service to exit instead of giving up")
+    args = parser.parse_args()
+
+    lock = LeaderLock(app.LEADER_LOCK)
+    if not lock.acquire(block=args.standby):
+        print(f"[SERVICE] Already running (pid {lock.holder()}); use --standby to wait")
+        sys.exit(1)
+    print(f"[SERVICE] Leader; serving on {app.SERVICE_SOCKET}")
+
+    log_cfg = app.load_log_config()
+    app.monitor_log.echo = log_cfg.get("echo_monitor_log", True)
+    machines = app.start_gateway(log_cfg)
+    server = ServiceServer(app.SERVICE_SOCKET, app.gateway_handlers(machines))
+    # gunicorn-style shutdown: SIGTERM ends serve_forever() cleanly
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        lock.release()
+
+
+if __name__ == "__main__":
+    main()
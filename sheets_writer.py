@@ -0,0 +1,274 @@
+import json
+import random
+import threading
+import time
+
+from q_parsers import numeric_value
+
+# HTTP statuses worth retrying: quota exceeded and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class SheetsClient:
+    """
+    One authorized spreadsheet, opened once and reused.
+
+    `authorize()` returns a gspread client; it is only called again after
+    invalidate(). Worksheet titles and header rows are cached for `ttl`
+    seconds so page views and writes don't re-list the spreadsheet.
+    """
+
+    def __init__(self, authorize, sheet_id, ttl=300):
+        self.authorize = authorize
+        self.sheet_id = sheet_id
+        self.ttl = ttl
+        self._spreadsheet = None
+        self._titles = None
+        self._titles_at = 0.0
+        self._headers = {}
+        self._lock = threading.RLock()
+
+    def spreadsheet(self):
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = self.authorize().open_by_key(self.sheet_id)
+            return self._spreadsheet
+
+    def invalidate(self):
+        with self._lock:
+            self._spreadsheet = None
+            self._titles = None
+            self._headers.clear()
+
+    def titles(self):
+        """
+        Worksheet titles, re-read at most every `ttl` seconds.
+        """
+        with self._lock:
+            if self._titles is None or time.monotonic() - self._titles_at > self.ttl:
+                self._titles = [ws.title for ws in self.spreadsheet().worksheets()]
+                self._titles_at = time.monotonic()
+            return list(self._titles)
+
+    def header(self, title):
+        """
+        Row 1 of the worksheet `title`, cached like titles().
+        """
+        with self._lock:
+            cached = self._headers.get(title)
+            if cached is None or time.monotonic() - cached[0] > self.ttl:
+                row = self.spreadsheet().worksheet(title).row_values(1)
+                cached = self._headers[title] = (time.monotonic(), row)
+            return cached[1]
+
+    def add_tab(self, title, header):
+        """
+        Create worksheet `title` sized for `header` and write the header row.
+        """
+        with self._lock:
+            ws = self.spreadsheet().add_worksheet(title=title, rows="1000", cols=str(len(header)))
+            ws.append_row(header)
+            if self._titles is not None:
+                self._titles.append(title)
+            self._headers[title] = (time.monotonic(), list(header))
+            return ws
+
+    def extend_header(self, title, names):
+        """
+        Append columns `names` to the header row of worksheet `title`,
+        growing the sheet if it is too narrow. Returns the new header.
+        """
+        with self._lock:
+            header = self.header(title)
+            names = [n for n in names if n not in header]
+            if not names:
+                return header
+            ws = self.spreadsheet().worksheet(title)
+            missing = len(header) + len(names) - ws.col_count
+            if missing > 0:
+                ws.add_cols(missing)
+            self.spreadsheet().values_update(
+                f"'{title}'!{_column_name(len(header) + 1)}1",
+                params={"valueInputOption": "RAW"},
+                body={"values": [names]}
+            )
+            header = header + names
+            self._headers[title] = (time.monotonic(), header)
+            return header
+
+
+def _column_name(number):
+    # 1 -> "A", 27 -> "AA"
+    name = ""
+    while number:
+        number, rest = divmod(number - 1, 26)
+        name = chr(ord("A") + rest) + name
+    return name
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_sheets_client(authorize, service_account_info, sheet_id):
+    """
+    Shared SheetsClient per (spreadsheet, service account), so reconnecting
+    the forwarder or rendering a page doesn't authorize again.
+    """
+    key = (sheet_id, service_account_info.get("client_email"),
+           service_account_info.get("private_key_id"))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = SheetsClient(lambda: authorize(service_account_info), sheet_id)
+        return _clients[key]
+
+
+class WideRowWriter:
+    """
+    Spool sink that writes one wide row per poll cycle into each machine's
+    worksheet instead of one long row per reading.
+
+    Spooled (tag, value, polled_at, machine, fields_json) readings are folded
+    per machine: a cycle ends when a tag comes round again, and tags that
+    didn't change (so weren't spooled) carry their last value forward.
+    Cells hold the parsed number (or single text field) of each reply, or
+    the raw reply when it parses to several fields (Q500). Columns come from
+    the tab's header row; tags without a column (e.g. one per tool of a
+    Q600 range) get one appended. A missing tab is created with `header`.
+
+    Each batch is one values_append per tab, spaced `min_interval` apart to
+    stay under the per-minute write quota; quota and server errors are
+    retried with exponential backoff before giving up. If a later tab of a
+    batch fails, the tabs already written are remembered, and their
+    readings are skipped when the Forwarder retries the batch.
+    """
+
+    def __init__(self, client, tab_for, header, min_interval=1.2, retries=5, max_backoff=64.0):
+        self.client = client
+        self.tab_for = tab_for
+        self.header = header
+        self.min_interval = min_interval
+        self.retries = retries
+        self.max_backoff = max_backoff
+        self.last_values = {}
+        self.appends = 0
+        self.retried = 0
+        self._last_call = 0.0
+        # {machine: [(tag, polled_at), ...]} at the head of the spool that
+        # reached the sheet in a batch that then failed on another tab
+        self._delivered = {}
+
+    @staticmethod
+    def _cell(value, fields):
+        parsed = json.loads(fields or "{}")
+        if len(parsed) > 1:
+            return value
+        cell = numeric_value(parsed)
+        if cell is None:
+            cell = next(iter(parsed.values())) if parsed else value
+        return cell
+
+    def fold(self, rows, last_values):
+        """
+        {machine: [wide row, ...]} for `rows`, updating `last_values` in place.
+        """
+        out = {}
+        current = {}
+        for tag, value, ts, machine, fields in rows:
+            cell = self._cell(value, fields)
+            seen, row_ts = current.get(machine, (set(), ts))
+            if tag in seen:
+                out.setdefault(machine, []).append(self._row(machine, row_ts, last_values))
+                seen, row_ts = set(), ts
+            seen.add(tag)
+            last_values.setdefault(machine, {})[tag] = cell
+            current[machine] = (seen, row_ts)
+        for machine, (seen, row_ts) in current.items():
+            out.setdefault(machine, []).append(self._row(machine, row_ts, last_values))
+        return out
+
+    def _row(self, machine, ts, last_values):
+        values = last_values.get(machine, {})
+        columns = self._columns(self.tab_for(machine), values)
+        return [ts] + [values.get(c, "") for c in columns[1:]]
+
+    def _columns(self, tab, tags):
+        if tab not in self.client.titles():
+            self.client.add_tab(tab, self.header)
+        columns = self.client.header(tab)
+        if not set(tags) <= set(columns):
+            columns = self.client.extend_header(tab, list(tags))
+        return columns
+
+    def _call(self, fn):
+        delay = 1.0
+        for attempt in range(self.retries + 1):
+            wait = self.min_interval - (time.monotonic() - self._last_call)
+            if wait > 0:
+                time.sleep(wait)
+            self._last_call = time.monotonic()
+            try:
+                return fn()
+            except Exception as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status not in RETRY_STATUSES or attempt == self.retries:
+                    raise
+                self.retried += 1
+                time.sleep(delay + random.uniform(0, delay / 2))
+                delay = min(delay * 2, self.max_backoff)
+
+    def __call__(self, rows):
+        # fold into a copy so a failed batch (retried later) starts clean
+        last_values = {m: dict(v) for m, v in self.last_values.items()}
+
+        # readings already appended by a failed attempt at this batch only
+        # advance the carried-forward values
+        skipped = {}
+        fresh = []
+        for row in rows:
+            tag, value, ts, machine, fields = row
+            done = self._delivered.get(machine, ())
+            seen = skipped.setdefault(machine, [])
+            if len(seen) < len(done) and done[len(seen)] == (tag, ts):
+                seen.append((tag, ts))
+                last_values.setdefault(machine, {})[tag] = self._cell(value, fields)
+            else:
+                # past (or off) the delivered prefix: everything else is new
+                self._delivered.pop(machine, None)
+                fresh.append(row)
+
+        spreadsheet = self.client.spreadsheet()
+        written = []
+        try:
+            for machine, wide_rows in self.fold(fresh, last_values).items():
+                tab = self.tab_for(machine)
+                self._call(lambda: spreadsheet.values_append(
+                    f"'{tab}'!A1",
+                    params={"valueInputOption": "RAW"},
+                    body={"values": wide_rows}
+                ))
+                self.appends += 1
+                written.append(machine)
+        except Exception:
+            self._delivered = {m: keys for m, keys in skipped.items() if keys}
+            for machine in written:
+                self._delivered[machine] = [(tag, ts) for tag, _, ts, m, _ in rows if m == machine]
+            raise
+        self._delivered = {}
+        self.last_values = last_values
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_row_writer(client, tab_for, header):
+    """
+    The WideRowWriter of `client`, kept across Forwarder reconnects so a
+    batch retried after a failure doesn't append rows twice.
+    """
+    with _writers_lock:
+        writer = _writers.get(client)
+        if writer is None:
+            writer = _writers[client] = WideRowWriter(client, tab_for, header)
+        writer.tab_for = tab_for
+        writer.header = header
+        return writer
@@ -0,0 +1,150 @@
+import sqlite3
+import threading
+import time
+
+from metrics import REGISTRY
+
+WRITE_SECONDS = REGISTRY.histogram(
+    "cnc_backend_write_seconds", "Time to write one batch to the back-end", ("backend",))
+WRITE_FAILURES = REGISTRY.counter(
+    "cnc_backend_write_failures_total", "Failed back-end connects or writes", ("backend",))
+
+
+class Spool:
+    """
+    Durable on-disk queue of poll rows (SQLite in WAL mode).
+
+    Every stored reading lands here first; the Forwarder drains it to the
+    configured back-end and only deletes rows once the back-end accepted
+    them, so an outage delays history instead of losing it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS readings ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " tag TEXT NOT NULL,"
+            " value TEXT,"
+            " polled_at TEXT NOT NULL,"
+            " machine TEXT,"
+            " fields TEXT)"
+        )
+        # older spools lack the columns added since
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(readings)")]
+        for column in ("machine", "fields"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE readings ADD COLUMN {column} TEXT")
+        self._conn.commit()
+        self.ready = threading.Event()
+
+    def append_many(self, rows):
+        """
+        Store (tag, value, polled_at_iso, machine, fields_json) tuples in one
+        transaction.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO readings (tag, value, polled_at, machine, fields)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows)
+        self.ready.set()
+
+    def peek(self, limit):
+        """
+        Oldest `limit` rows as (id, tag, value, polled_at, machine, fields_json) tuples.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, tag, value, polled_at, machine, fields"
+                " FROM readings ORDER BY id LIMIT ?",
+                (limit,)).fetchall()
+
+    def ack(self, last_id):
+        """
+        Delete every row up to and including `last_id`.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM readings WHERE id <= ?", (last_id,))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+
+
+class Forwarder:
+    """
+    Drains a Spool to a back-end in large batches.
+
+    `connect()` returns a callable taking a list of (tag, value, polled_at,
+    machine, fields_json) tuples, or None while no back-end is configured. A failing connect or
+    write drops the cached sink and retries with exponential backoff; rows
+    stay in the spool until a write succeeds. `backend()` names the
+    back-end for metrics.
+    """
+
+    def __init__(self, spool, connect, batch_size=1000, idle=5.0, max_backoff=60.0,
+                 backend=lambda: "default"):
+        self.spool = spool
+        self.connect = connect
+        self.backend = backend
+        self.batch_size = batch_size
+        self.idle = idle
+        self.max_backoff = max_backoff
+        self.sink = None
+        self.backoff = idle
+        self.forwarded = 0
+        self.failures = 0
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def reset(self):
+        """
+        Forget the current sink so the next batch reconnects (e.g. after the
+        logging settings changed).
+        """
+        self.sink = None
+        self.backoff = self.idle
+        self.spool.ready.set()
+
+    def _wait(self, seconds):
+        self.spool.ready.wait(seconds)
+        self.spool.ready.clear()
+
+    def _run(self):
+        while True:
+            rows = self.spool.peek(self.batch_size)
+            if not rows:
+                self._wait(self.idle)
+                continue
+            try:
+                if self.sink is None:
+                    self.sink = self.connect()
+                if self.sink is None:
+                    self._wait(self.idle)
+                    continue
+                started = time.monotonic()
+                self.sink([row[1:] for row in rows])
+                WRITE_SECONDS.observe(time.monotonic() - started, backend=self.backend())
+            except Exception as e:
+                self.sink = None
+                self.failures += 1
+                WRITE_FAILURES.inc(backend=self.backend())
+                self.last_error = e
+                print(f"[SPOOL] Forward failed ({self.spool.count()} row(s) pending), "
+                      f"retrying in {self.backoff:.0f}s: {e}")
+                time.sleep(self.backoff)
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                continue
+            self.spool.ack(rows[-1][0])
+            self.forwarded += len(rows)
+            self.backoff = self.idle
+            # a short batch means we've caught up: let the next few seconds of
+            # readings accumulate rather than calling the back-end per row
+            if len(rows) < self.batch_size:
+                time.sleep(self.idle)
@@ -0,0 +1,191 @@
+"""
+Read path and rollups for the SQL back-end.
+
+Besides the raw machine_poll rows, every numeric reading is folded into
+machine_poll_rollup: one row per (machine, tag, resolution, bucket) with
+count/min/max/sum/last, for 1-minute, 1-hour and 1-day buckets. Rollups are
+updated in the same transaction as the raw insert, so history queries read
+a few hundred pre-aggregated rows instead of scanning raw readings.
+
+Only imported once the SQL back-end is in use (it needs SQLAlchemy).
+"""
+import re
+from datetime import datetime
+
+from sqlalchemy import (Table, Column, Index, Integer, BigInteger, Float, String,
+                        PrimaryKeyConstraint, and_, bindparam, case, select)
+
+# rollup bucket sizes in seconds
+RESOLUTIONS = (60, 3600, 86400)
+
+BUCKET_RE = re.compile(r'^(\d+)\s*([smhd]?)$', re.IGNORECASE)
+UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# most raw rows returned when no bucket is asked for
+RAW_LIMIT = 10000
+
+# tags per IN list when looking up existing rollups; SQL Server allows at
+# most 2100 parameters per statement
+IN_CHUNK = 500
+
+
+def parse_bucket(text):
+    """
+    "30s", "5m", "1h", "1d" or plain seconds -> seconds.
+    """
+    m = BUCKET_RE.match(text.strip())
+    if not m or int(m.group(1)) <= 0:
+        raise ValueError(f"Bad bucket {text!r}; use e.g. 30s, 5m, 1h or 1d")
+    return int(m.group(1)) * UNITS[m.group(2).lower()]
+
+def define_tables(meta, poll_table):
+    """
+    The rollup table and the composite index that keeps raw range scans
+    cheap. Call before meta.create_all(); run create_indexes() afterwards
+    for databases whose machine_poll predates the index.
+    """
+    rollup = Table('machine_poll_rollup', meta,
+        Column('machine', String(128), nullable=False),
+        Column('tag', String(128), nullable=False),
+        Column('resolution', Integer, nullable=False),
+        Column('bucket_start', BigInteger, nullable=False),
+        Column('samples', Integer, nullable=False),
+        Column('v_min', Float),
+        Column('v_max', Float),
+        Column('v_sum', Float),
+        Column('v_last', Float),
+        Column('last_at', Float),
+        PrimaryKeyConstraint('machine', 'tag', 'resolution', 'bucket_start'),
+    )
+    index = Index('ix_machine_poll_tag_time',
+                  poll_table.c.tag, poll_table.c.machine, poll_table.c.polled_at)
+    return rollup, index
+
+def create_indexes(engine, index):
+    index.create(engine, checkfirst=True)
+
+
+def aggregate(readings):
+    """
+    Fold (machine, tag, epoch_seconds, number) readings into
+    {(machine, tag, resolution, bucket_start): [samples, min, max, sum, last, last_at]}.
+    """
+    buckets = {}
+    for machine, tag, ts, value in readings:
+        for resolution in RESOLUTIONS:
+            key = (machine, tag, resolution, int(ts // resolution) * resolution)
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = [1, value, value, value, value, ts]
+                continue
+            b[0] += 1
+            b[1] = min(b[1], value)
+            b[2] = max(b[2], value)
+            b[3] += value
+            if ts >= b[5]:
+                b[4], b[5] = value, ts
+    return buckets
+
+def apply_rollups(conn, rollup, buckets):
+    """
+    Merge aggregated buckets into the rollup table: look up which already
+    exist (per resolution, one query per IN_CHUNK tags), then update those
+    and insert the rest, each as a single executemany.
+    """
+    c = rollup.c
+    spans = {}
+    for machine, tag, resolution, start in buckets:
+        span = spans.setdefault(resolution, [start, start, set(), set()])
+        span[0] = min(span[0], start)
+        span[1] = max(span[1], start)
+        span[2].add(machine)
+        span[3].add(tag)
+    existing = set()
+    for resolution, (lo, hi, machines, tags) in spans.items():
+        tags = sorted(tags)
+        for i in range(0, len(tags), IN_CHUNK):
+            rows = conn.execute(select(c.machine, c.tag, c.bucket_start).where(and_(
+                c.resolution == resolution, c.bucket_start >= lo, c.bucket_start <= hi,
+                c.machine.in_(sorted(machines)), c.tag.in_(tags[i:i + IN_CHUNK]))))
+            # may include buckets of other machine/tag pairs; only ours matter
+            existing.update((machine, tag, resolution, start) for machine, tag, start in rows)
+
+    updates, inserts = [], []
+    for key, (n, lo, hi, total, last, last_at) in buckets.items():
+        machine, tag, resolution, start = key
+        if key in existing:
+            # bind names must differ from the columns being SET
+            updates.append({"k_machine": machine, "k_tag": tag, "k_resolution": resolution,
+                            "k_start": start, "b_samples": n, "b_min": lo, "b_max": hi,
+                            "b_sum": total, "b_last": last, "b_last_at": last_at})
+        else:
+            inserts.append({"machine": machine, "tag": tag, "resolution": resolution,
+                            "bucket_start": start, "samples": n, "v_min": lo, "v_max": hi,
+                            "v_sum": total, "v_last": last, "last_at": last_at})
+
+    if updates:
+        newer = c.last_at <= bindparam("b_last_at")
+        conn.execute(
+            rollup.update()
+            .where(and_(c.machine == bindparam("k_machine"), c.tag == bindparam("k_tag"),
+                        c.resolution == bindparam("k_resolution"),
+                        c.bucket_start == bindparam("k_start")))
+            .values(
+                samples=c.samples + bindparam("b_samples"),
+                v_min=case((c.v_min <= bindparam("b_min"), c.v_min), else_=bindparam("b_min")),
+                v_max=case((c.v_max >= bindparam("b_max"), c.v_max), else_=bindparam("b_max")),
+                v_sum=c.v_sum + bindparam("b_sum"),
+                v_last=case((newer, bindparam("b_last")), else_=c.v_last),
+                last_at=case((newer, bindparam("b_last_at")), else_=c.last_at),
+            ),
+            updates
+        )
+    if inserts:
+        conn.execute(rollup.insert(), inserts)
+
+
+def query_history(engine, poll_table, rollup, machine, tag, start, end, bucket=None):
+    """
+    Readings of one tag between epoch seconds `start` and `end`.
+
+    With `bucket` (seconds) the coarsest rollup that fits into it is read and
+    merged into [{"t", "min", "max", "avg", "last", "n"}] buckets. Without,
+    up to RAW_LIMIT raw [{"t", "v"}] rows come from machine_poll via the
+    (tag, machine, polled_at) index.
+    """
+    if not bucket:
+        p = poll_table.c
+        stmt = (select(p.polled_at, p.value)
+                .where(and_(p.tag == tag, p.machine == machine,
+                            p.polled_at >= datetime.fromtimestamp(start),
+                            p.polled_at <= datetime.fromtimestamp(end)))
+                .order_by(p.polled_at)
+                .limit(RAW_LIMIT))
+        with engine.connect() as conn:
+            return [{"t": ts.timestamp(), "v": value} for ts, value in conn.execute(stmt)]
+
+    fitting = [r for r in RESOLUTIONS if r <= bucket and bucket % r == 0]
+    resolution = max(fitting) if fitting else RESOLUTIONS[0]
+    c = rollup.c
+    stmt = (select(c.bucket_start, c.samples, c.v_min, c.v_max, c.v_sum, c.v_last)
+            .where(and_(c.machine == machine, c.tag == tag, c.resolution == resolution,
+                        c.bucket_start >= int(start // resolution) * resolution,
+                        c.bucket_start <= end))
+            .order_by(c.bucket_start))
+
+    out = []
+    with engine.connect() as conn:
+        for bucket_start, n, lo, hi, total, last in conn.execute(stmt):
+            t = bucket_start // bucket * bucket
+            if out and out[-1]["t"] == t:
+                b = out[-1]
+                b["n"] += n
+                b["min"] = min(b["min"], lo)
+                b["max"] = max(b["max"], hi)
+                b["sum"] += total
+                b["last"] = last
+            else:
+                out.append({"t": t, "n": n, "min": lo, "max": hi, "sum": total, "last": last})
+    for b in out:
+        b["avg"] = b.pop("sum") / b["n"] if b["n"] else None
+    return out